@@ -0,0 +1,237 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, request, abort
+
+from settings import (RATE_LIMIT_STORE, RATE_LIMIT_REDIS_URL,
+                      RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST,
+                      DB_CONCURRENCY_LIMIT, DB_CONCURRENCY_WAIT_MS)
+
+logger = logging.getLogger(__name__)
+
+# Buckets kept in memory, the least recently used are dropped beyond
+MAX_BUCKETS = 100000
+
+# Seconds an overloaded client is asked to wait before retrying
+OVERLOAD_RETRY_AFTER = 1
+
+# Seconds between two tries of an async request waiting for a slot
+ASYNC_SLOT_POLL = 0.005
+
+
+class Refused(Exception):
+    """Raised for an async request refused with status 429 or 503."""
+
+    def __init__(self, status, retry_after):
+        self.status = status
+        self.retry_after = retry_after
+
+
+def gcra(tat, now, interval, burst):
+    """
+    Takes a token from a bucket refilled with one token every interval
+    seconds and holding up to burst tokens, stored as the theoretical
+    arrival time tat of its next request (None for a full bucket).
+    Returns the new tat and the seconds to wait, 0 when a token was
+    taken.
+    """
+    tat = now if tat is None else max(tat, now)
+    wait = tat + interval - now - burst * interval
+    if wait > 0:
+        return tat, wait
+    return tat + interval, 0
+
+
+"""
+MemoryBucketStore
+    keeps the token buckets in this process, which limits the requests
+    each worker admits
+"""
+class MemoryBucketStore:
+
+    def __init__(self, max_buckets=MAX_BUCKETS):
+        self.lock = threading.Lock()
+        self.max_buckets = max_buckets
+        self.buckets = OrderedDict()
+
+    def take(self, key, interval, burst):
+        """Returns 0 when a token was taken, or the seconds to wait."""
+        now = time.monotonic()
+        with self.lock:
+            tat, wait = gcra(self.buckets.get(key), now, interval, burst)
+            self.buckets[key] = tat
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+        return wait
+
+
+"""
+RedisBucketStore
+    keeps the token buckets in a Redis server, or any server speaking
+    its protocol, so the limits hold across workers. A bucket is a key
+    holding its tat, updated in a WATCH/MULTI transaction and expiring
+    once the bucket is full again.
+"""
+class RedisBucketStore:
+
+    KEY = 'trivia:rate-limit:{}'
+
+    def __init__(self, url=RATE_LIMIT_REDIS_URL):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.watch_error = redis.WatchError
+
+    def take(self, key, interval, burst):
+        key = self.KEY.format(key)
+        with self.client.pipeline() as pipeline:
+            while True:
+                try:
+                    pipeline.watch(key)
+                    tat = pipeline.get(key)
+                    now = time.time()
+                    tat, wait = gcra(None if tat is None else float(tat),
+                                     now, interval, burst)
+                    if wait:
+                        return wait
+                    pipeline.multi()
+                    pipeline.set(key, repr(tat),
+                                 px=int((tat - now) * 1000) + 1)
+                    pipeline.execute()
+                    return 0
+                except self.watch_error:
+                    # Another worker took a token meanwhile, try again
+                    continue
+
+
+BUCKET_STORES = {
+    'memory': MemoryBucketStore,
+    'redis': RedisBucketStore,
+}
+
+
+"""
+AdmissionControl
+    admits the requests of expensive views. Each client gets a token
+    bucket per view refilled at per_minute requests a minute, and is
+    answered 429 when it is empty. At most concurrency requests of
+    these views run at once in this process, others wait up to
+    wait_ms for a slot and are answered 503. Both set Retry-After.
+    A rate or concurrency of 0 turns that limit off.
+"""
+class AdmissionControl:
+
+    def __init__(self, per_minute=RATE_LIMIT_PER_MINUTE,
+                 burst=RATE_LIMIT_BURST, concurrency=DB_CONCURRENCY_LIMIT,
+                 wait_ms=DB_CONCURRENCY_WAIT_MS, store=None):
+        self.per_minute = per_minute
+        self.interval = 60 / per_minute if per_minute else None
+        self.burst = burst
+        self.store = store if store is not None else (
+            BUCKET_STORES[RATE_LIMIT_STORE]() if per_minute else None)
+        self.concurrency = concurrency
+        self.slots = (threading.BoundedSemaphore(concurrency)
+                      if concurrency else None)
+        self.wait = wait_ms / 1000
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.routes = {}
+
+    def count(self, route, counter):
+        with self.lock:
+            counters = self.routes.setdefault(route, {
+                'admitted': 0, 'rate_limited': 0, 'overloaded': 0})
+            counters[counter] += 1
+
+    def rate_limit_wait(self, route, client):
+        """Returns the seconds the client must wait, 0 if admitted."""
+        if self.interval is None:
+            return 0
+        key = '{}:{}'.format(route, client)
+        try:
+            return self.store.take(key, self.interval, self.burst)
+        except Exception as e:
+            # Rather serve everyone than no one when the store is down
+            logger.warning('Rate limit store failed: %s', e)
+            return 0
+
+    def enter(self):
+        with self.lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+        if self.slots is not None:
+            self.slots.release()
+
+    def admit(self, view):
+        """Decorates a view with the rate and concurrency limits."""
+        route = view.__name__
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            wait = self.rate_limit_wait(route, request.remote_addr)
+            if wait:
+                self.count(route, 'rate_limited')
+                g.retry_after = wait
+                abort(429)
+            if (self.slots is not None and
+                    not self.slots.acquire(timeout=self.wait)):
+                self.count(route, 'overloaded')
+                g.retry_after = OVERLOAD_RETRY_AFTER
+                abort(503)
+            self.count(route, 'admitted')
+            self.enter()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                self.leave()
+        return wrapper
+
+    async def acquire_async(self):
+        """Waits up to wait seconds for a slot without blocking the loop."""
+        deadline = time.monotonic() + self.wait
+        while not self.slots.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(ASYNC_SLOT_POLL)
+        return True
+
+    async def admit_async(self, route, client, handler, *args):
+        """
+        Awaits handler(*args) within the limits of route, as admit does
+        for views, or raises Refused.
+        """
+        wait = self.rate_limit_wait(route, client)
+        if wait:
+            self.count(route, 'rate_limited')
+            raise Refused(429, wait)
+        if self.slots is not None and not await self.acquire_async():
+            self.count(route, 'overloaded')
+            raise Refused(503, OVERLOAD_RETRY_AFTER)
+        self.count(route, 'admitted')
+        self.enter()
+        try:
+            return await handler(*args)
+        finally:
+            self.leave()
+
+    def status(self):
+        with self.lock:
+            return {
+                'rate_per_minute': self.per_minute,
+                'burst': self.burst,
+                'store': type(self.store).__name__ if self.store else None,
+                'concurrency_limit': self.concurrency,
+                'in_flight': self.in_flight,
+                'peak_in_flight': self.peak_in_flight,
+                'routes': {route: dict(counters)
+                           for route, counters in self.routes.items()}
+            }
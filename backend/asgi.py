@@ -0,0 +1,563 @@
+"""
+ASGI entry point of the trivia API.
+
+The hot read routes (categories, question lists, search and quizzes)
+are served by async handlers that read rows through an async driver
+pool: asyncpg for Postgres or aiosqlite for SQLite, installed with pip.
+A request waiting on the database then holds no thread. Every other
+route, and every write, is passed to the Flask app through WSGI in a
+thread pool, so the JSON contract and error handlers are the Flask
+app's own, and streamed responses are sent as they are produced.
+
+The search and quiz handlers are rate and concurrency limited by the
+admission control of the Flask app, waiting for a slot without holding
+a thread. The in-memory counts, category versions and quiz and search
+indexes are shared with the Flask app; calls into them run in the thread pool
+as they may load from the database through SQLAlchemy.
+
+Run it with any ASGI server, for example:
+    uvicorn --factory asgi:create_asgi_app
+"""
+import asyncio
+import heapq
+import io
+import json
+import math
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from models import db
+from flaskr import (create_app, ERROR_MESSAGES, QUESTIONS_PER_PAGE,
+                    MAX_QUESTIONS_PER_PAGE, quiz_category_id)
+from counts import question_counts
+from quiz import choose_question_id, target_difficulty
+from search import search_index
+from serialize import (QUESTION_FIELDS, format_question, format_questions,
+                       dumps)
+from cache import table_versions, body_etag
+from admission import Refused
+from settings import CACHE_MAX_AGE, DB_POOL_SIZE
+
+SELECT_QUESTIONS = 'SELECT {} FROM questions'.format(
+    ', '.join(QUESTION_FIELDS))
+
+
+# Headers the Flask app adds to every response
+CORS_HEADERS = [
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Headers', 'Content-Type,Authorization,true'),
+    ('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS'),
+]
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status):
+        self.status = status
+
+
+class NotModified(Exception):
+
+    def __init__(self, headers):
+        self.headers = headers
+
+
+"""
+AsyncDatabase
+    pool of async connections to the database of a SQLAlchemy URL.
+    Queries use ? placeholders whatever the driver.
+"""
+class AsyncDatabase:
+
+    def __init__(self, url, size=None):
+        self.url = url
+        self.size = size or 10
+        self.pool = None
+        self.connections = None
+
+    async def connect(self):
+        if self.url.startswith('postgres'):
+            import asyncpg
+            self.pool = await asyncpg.create_pool(
+                re.sub(r'^postgres(ql)?(\+\w+)?://', 'postgresql://',
+                       self.url), max_size=self.size)
+        elif self.url.startswith('sqlite:///'):
+            import aiosqlite
+            self.connections = asyncio.Queue()
+            for _ in range(self.size):
+                self.connections.put_nowait(
+                    await aiosqlite.connect(self.url[len('sqlite:///'):]))
+        else:
+            raise ValueError('No async driver for {}'.format(self.url))
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+        if self.connections is not None:
+            while not self.connections.empty():
+                await self.connections.get_nowait().close()
+
+    async def fetch(self, sql, *args):
+        """Returns the rows of a query as tuples."""
+        if self.pool is not None:
+            count = iter(range(1, len(args) + 1))
+            sql = re.sub(r'\?', lambda match: '${}'.format(next(count)), sql)
+            rows = await self.pool.fetch(sql, *args)
+            return [tuple(row) for row in rows]
+
+        connection = await self.connections.get()
+        try:
+            async with connection.execute(sql, args) as cursor:
+                return await cursor.fetchall()
+        finally:
+            self.connections.put_nowait(connection)
+
+    async def fetchval(self, sql, *args):
+        rows = await self.fetch(sql, *args)
+        return rows[0][0] if rows else None
+
+
+"""
+Request
+    the parts of an ASGI HTTP request the async handlers use
+"""
+class Request:
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.remote_addr = (scope.get('client') or [None])[0]
+        self.query_string = scope.get('query_string', b'').decode('latin-1')
+        self.args = {key: values[0] for key, values in
+                     parse_qs(self.query_string).items()}
+        self.headers = {key.decode('latin-1').lower(): value.decode('latin-1')
+                        for key, value in scope.get('headers', [])}
+        self.body = body
+
+    @property
+    def full_path(self):
+        # Matches flask.Request.full_path
+        return '{}?{}'.format(self.path, self.query_string)
+
+    def arg(self, name, default=None, type=None):
+        if name not in self.args:
+            return default
+        try:
+            return type(self.args[name]) if type else self.args[name]
+        except ValueError:
+            return default
+
+    def get_json(self):
+        return json.loads(self.body or b'null')
+
+    def not_modified(self, etag):
+        header = self.headers.get('if-none-match', '')
+        # Compared weakly, like flask.Request.if_none_match.contains_weak
+        tags = [re.sub(r'^W/', '', tag.strip()) for tag in header.split(',')]
+        return '"{}"'.format(etag) in tags or '*' in tags
+
+
+def wsgi_environ(scope, body):
+    """Returns the WSGI environ of an ASGI HTTP request scope."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode(
+            'latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+            continue
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = 'HTTP_' + name
+        environ[key] = (environ[key] + ',' + value if key in environ
+                        else value)
+    return environ
+
+
+"""
+TriviaASGI
+    ASGI application serving the hot read routes with async handlers
+    and passing the other requests to the Flask app
+"""
+class TriviaASGI:
+
+    def __init__(self, flask_app, database, threads=None):
+        self.flask_app = flask_app
+        self.database = database
+        self.executor = ThreadPoolExecutor(threads)
+        # The limits of the Flask app's expensive views, shared with it
+        self.admission = flask_app.extensions['admission']
+        self.category_rows = None
+        self.category_version = None
+        self.routes = [
+            ('GET', re.compile(r'^/categories$'), self.get_categories),
+            ('GET', re.compile(r'^/questions$'), self.get_questions),
+            ('GET', re.compile(r'^/categories/(\d+)/questions$'),
+             self.get_questions_by_category),
+            ('POST', re.compile(r'^/questions/search$'),
+             self.search_questions),
+            ('POST', re.compile(r'^/quizzes$'), self.play_quiz),
+        ]
+        self.limited = {self.search_questions, self.play_quiz}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        for method, pattern, handler in self.routes:
+            match = pattern.match(scope['path'])
+            if match and scope['method'] == method:
+                request = Request(scope, body)
+                try:
+                    if handler in self.limited:
+                        status, headers, content = (
+                            await self.admission.admit_async(
+                                handler.__name__, request.remote_addr,
+                                handler, request, *match.groups()))
+                    else:
+                        status, headers, content = await handler(
+                            request, *match.groups())
+                except Refused as e:
+                    status, headers, content = self.error(e.status)
+                    headers = headers + [
+                        ('Retry-After', str(math.ceil(e.retry_after)))]
+                except HTTPError as e:
+                    status, headers, content = self.error(e.status)
+                except NotModified as e:
+                    status, headers, content = 304, e.headers, b''
+                headers = headers + CORS_HEADERS + [
+                    ('Content-Length', str(len(content)))]
+                await self.respond(send, status, headers, content)
+                return
+
+        await self.call_wsgi(scope, body, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.database.connect()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.database.close()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def respond(self, send, status, headers, content):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'),
+                         value.encode('latin-1')) for name, value in headers],
+        })
+        await send({'type': 'http.response.body', 'body': content})
+
+    def error(self, status):
+        return status, [('Content-Type', 'application/json')], dumps({
+            'success': False,
+            'message': ERROR_MESSAGES[status],
+            'error': status
+        })
+
+    def json(self, data, request=None):
+        """
+        Returns a JSON response, with the ETag of its body when the
+        request is given, raising NotModified if the client has it.
+        """
+        headers = [('Content-Type', 'application/json')]
+        body = dumps(data)
+        if request is not None:
+            etag = body_etag(body)
+            if request.not_modified(etag):
+                raise NotModified(self.cache_headers(etag))
+            headers += self.cache_headers(etag)
+        return 200, headers, body
+
+    def cache_headers(self, etag):
+        return [
+            ('ETag', '"{}"'.format(etag)),
+            ('Cache-Control', 'public, max-age={}, must-revalidate'.format(
+                CACHE_MAX_AGE)),
+        ]
+
+    async def run_sync(self, fn, *args):
+        """Runs fn in the thread pool inside a Flask app context."""
+        def call():
+            with self.flask_app.app_context():
+                try:
+                    return fn(*args)
+                finally:
+                    db.session.remove()
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, call)
+
+    async def call_wsgi(self, scope, body, send):
+        """
+        Runs a request through the Flask app in the thread pool, sending
+        each chunk of its body as the app yields it, so a streamed
+        response is never held in memory. The thread waits for each
+        chunk to be sent.
+        """
+        loop = asyncio.get_running_loop()
+
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def call():
+            started = []
+
+            def start_response(status, headers, exc_info=None):
+                if exc_info and started and started[0] is None:
+                    raise exc_info[1].with_traceback(exc_info[2])
+                started[:] = [{
+                    'type': 'http.response.start',
+                    'status': int(status.split(' ', 1)[0]),
+                    'headers': [(name.lower().encode('latin-1'),
+                                 value.encode('latin-1'))
+                                for name, value in headers],
+                }]
+
+            def send_start():
+                # Sent with the first chunk, start_response may be called
+                # again until then
+                if started[0] is not None:
+                    send_sync(started[0])
+                    started[0] = None
+
+            response = self.flask_app(wsgi_environ(scope, body),
+                                      start_response)
+            try:
+                for chunk in response:
+                    if chunk:
+                        send_start()
+                        send_sync({'type': 'http.response.body',
+                                   'body': chunk, 'more_body': True})
+                send_start()
+                send_sync({'type': 'http.response.body', 'body': b''})
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+
+        await loop.run_in_executor(self.executor, call)
+
+    async def categories(self):
+        """Returns the (id, type) of the categories, cached per version."""
+        version = table_versions.get('categories')
+        if self.category_rows is None or self.category_version != version:
+            self.category_rows = await self.database.fetch(
+                'SELECT id, type FROM categories ORDER BY id')
+            self.category_version = version
+        return self.category_rows
+
+    def cursor_limit(self, request):
+        limit = request.arg('limit', QUESTIONS_PER_PAGE, type=int)
+        if limit < 1 or limit > MAX_QUESTIONS_PER_PAGE:
+            raise HTTPError(400)
+        return limit
+
+    def check_cursor(self, request):
+        """Raises 400 for a bad cursor limit, like flaskr.check_cursor."""
+        if request.arg('after', type=int) is not None:
+            self.cursor_limit(request)
+
+    async def paginate(self, request, where='', params=()):
+        """
+        Returns a page of questions and the next cursor, like
+        flaskr.paginate_request.
+        """
+        after = request.arg('after', type=int)
+        if after is None:
+            page = request.arg('page', 1, type=int)
+            if page < 1:
+                raise HTTPError(404)
+            limit = QUESTIONS_PER_PAGE
+            rows = await self.database.fetch(
+                '{} {} ORDER BY id LIMIT ? OFFSET ?'.format(
+                    SELECT_QUESTIONS, 'WHERE ' + where if where else ''),
+                *params, limit, (page - 1) * limit)
+            if not rows and page != 1:
+                raise HTTPError(404)
+        else:
+            limit = self.cursor_limit(request)
+            rows = await self.database.fetch(
+                '{} WHERE {} id > ? ORDER BY id LIMIT ?'.format(
+                    SELECT_QUESTIONS, where + ' AND' if where else ''),
+                *params, after, limit)
+
+        questions = format_questions(rows)
+        next_cursor = rows[-1][0] if len(rows) == limit else None
+        return questions, next_cursor
+
+    async def get_categories(self, request):
+        try:
+            categories = [type for id, type in await self.categories()]
+        except Exception as e:
+            print(e)
+            raise HTTPError(404)
+        return self.json({
+            'success': True,
+            'categories': categories,
+        }, request)
+
+    async def get_questions(self, request):
+        self.check_cursor(request)
+        try:
+            questions, next_cursor = await self.paginate(request)
+            if not questions and 'after' not in request.args:
+                raise HTTPError(404)
+            categories = [type for id, type in await self.categories()]
+            total = await self.run_sync(question_counts.total)
+        except Exception as e:
+            print(e)
+            raise HTTPError(404)
+
+        return self.json({
+            'success': True,
+            'questions': questions,
+            'total_questions': total,
+            'categories': categories,
+            'current_category': request.arg('category'),
+            'next_cursor': next_cursor
+        }, request)
+
+    async def get_questions_by_category(self, request, category_id):
+        self.check_cursor(request)
+        category_id = int(category_id)
+        try:
+            category_type = dict(await self.categories()).get(category_id)
+            if category_type is None:
+                raise HTTPError(404)
+            questions, next_cursor = await self.paginate(
+                request, 'category = ?', (category_id,))
+            total = await self.run_sync(question_counts.category, category_id)
+        except Exception as e:
+            print(e)
+            raise HTTPError(404)
+
+        return self.json({
+            'success': True,
+            'questions': questions,
+            'total_questions': total,
+            'current_category': category_type,
+            'next_cursor': next_cursor
+        }, request)
+
+    async def search_questions(self, request):
+        self.check_cursor(request)
+        try:
+            search_term = request.get_json().get('searchTerm')
+            ids = await self.run_sync(search_index.search, search_term)
+
+            after = request.arg('after', type=int)
+            next_cursor = None
+            if after is None:
+                page = request.arg('page', 1, type=int)
+                if page < 1:
+                    raise HTTPError(404)
+                start = (page - 1) * QUESTIONS_PER_PAGE
+                page_ids = ids[start:start + QUESTIONS_PER_PAGE]
+                if not page_ids and page != 1:
+                    raise HTTPError(404)
+            else:
+                limit = self.cursor_limit(request)
+                page_ids = heapq.nsmallest(limit, (i for i in ids if i > after))
+                if len(page_ids) == limit:
+                    next_cursor = page_ids[-1]
+
+            questions = []
+            if page_ids:
+                rows = await self.database.fetch('{} WHERE id IN ({})'.format(
+                    SELECT_QUESTIONS, ', '.join('?' * len(page_ids))),
+                    *page_ids)
+                by_id = {row[0]: format_question(row) for row in rows}
+                questions = [by_id[i] for i in page_ids if i in by_id]
+        except Exception as e:
+            print(e)
+            raise HTTPError(404)
+
+        return self.json({
+            'success': True,
+            'questions': questions,
+            'total_questions': len(ids),
+            'current_category': request.arg('category'),
+            'next_cursor': next_cursor
+        })
+
+    async def play_quiz(self, request):
+        try:
+            body = request.get_json()
+            category_id = quiz_category_id(body.get('quiz_category'))
+            previous = set(body.get('previous_questions', None) or ())
+
+            difficulty = body.get('difficulty')
+            if difficulty is not None:
+                difficulty = target_difficulty(
+                    int(difficulty), body.get('correct'))
+
+            while True:
+                question_id = await self.run_sync(
+                    choose_question_id, category_id, previous, difficulty)
+                if question_id is None:
+                    raise HTTPError(404)
+                rows = await self.database.fetch(
+                    SELECT_QUESTIONS + ' WHERE id = ?', question_id)
+                if rows:
+                    break
+                # Deleted since the index was built, draw again without it
+                previous.add(question_id)
+        except Exception as e:
+            print(e)
+            raise HTTPError(404)
+
+        question = format_question(rows[0])
+        if difficulty is not None:
+            difficulty = question['difficulty']
+
+        return self.json({
+            'success': True,
+            'question': question,
+            'difficulty': difficulty
+        })
+
+
+"""
+create_asgi_app(test_config)
+    creates the Flask app and the ASGI app serving it
+"""
+def create_asgi_app(test_config=None):
+    flask_app = create_app(test_config)
+    database = AsyncDatabase(flask_app.config['SQLALCHEMY_DATABASE_URI'],
+                             DB_POOL_SIZE)
+    return TriviaASGI(flask_app, database)
@@ -0,0 +1,91 @@
+"""
+Benchmark of the WSGI and ASGI serving modes under concurrency.
+
+Loads a database with benchmarks.data, serves it with the Flask app on
+a threaded WSGI server and with asgi.py on uvicorn, then sends the same
+random mix of requests to both at each concurrency level and reports
+the p50/p95/p99 latency and requests per second.
+
+Run from the backend folder, with uvicorn and aiosqlite (or asyncpg for
+a scratch Postgres database, whose tables are dropped) installed:
+    python -m benchmarks.bench_asgi --size 10000 --concurrency 1,8,32
+"""
+import argparse
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+from flaskr import create_app
+from asgi import create_asgi_app
+from benchmarks.data import load
+from benchmarks.suite import (HTTPTarget, run_load, print_run,
+                              NO_ADMISSION_LIMITS)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def serve_wsgi(database):
+    port = free_port()
+    server = make_server('127.0.0.1', port, create_app(dict(
+        NO_ADMISSION_LIMITS, SQLALCHEMY_DATABASE_URI=database)),
+        threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:{}'.format(port), server.shutdown
+
+
+def serve_asgi(database):
+    import uvicorn
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(
+        create_asgi_app(dict(NO_ADMISSION_LIMITS,
+                             SQLALCHEMY_DATABASE_URI=database)),
+        host='127.0.0.1', port=port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+
+    def shutdown():
+        server.should_exit = True
+    return 'http://127.0.0.1:{}'.format(port), shutdown
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--database',
+                        help='Postgres URL, a new SQLite file by default')
+    parser.add_argument('--concurrency', default='1,8,32')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    database = args.database or 'sqlite:///' + os.path.join(
+        tempfile.mkdtemp(), 'asgi.db')
+    load(database, args.size)
+
+    for mode, serve in [('wsgi', serve_wsgi), ('asgi', serve_asgi)]:
+        url, shutdown = serve(database)
+        try:
+            for concurrency in args.concurrency.split(','):
+                print_run({
+                    'size': args.size,
+                    'mode': 'load ' + mode,
+                    'concurrency': int(concurrency),
+                    'results': run_load(HTTPTarget(url), args.size,
+                                        int(concurrency), args.requests,
+                                        args.seed)
+                })
+        finally:
+            shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark of the category listing and quiz queries before and after
+questions.category became an indexed integer foreign key.
+
+The old schema is rebuilt as questions_legacy, a copy of the questions
+with a string category and no index, next to the new questions table.
+
+Run from the backend folder:
+    python -m benchmarks.bench_category --size 100000
+"""
+import argparse
+
+from sqlalchemy import text
+
+from models import db
+from flaskr import QUESTIONS_PER_PAGE
+from benchmarks.common import sqlite_app, drop_sqlite, measure, report
+from benchmarks.data import seed
+
+CATEGORY = 3
+PREVIOUS = list(range(1, 200, 7))
+
+
+def create_legacy():
+    db.session.execute(text(
+        'CREATE TABLE questions_legacy (id INTEGER PRIMARY KEY, '
+        'question VARCHAR, answer VARCHAR, category VARCHAR, '
+        'difficulty INTEGER)'))
+    db.session.execute(text(
+        'INSERT INTO questions_legacy SELECT id, question, answer, '
+        'CAST(category AS TEXT), difficulty FROM questions'))
+    db.session.commit()
+
+
+def listing(table, category):
+    page = db.session.execute(text(
+        'SELECT * FROM {} WHERE category = :category ORDER BY id '
+        'LIMIT :limit'.format(table)),
+        {'category': category, 'limit': QUESTIONS_PER_PAGE}).fetchall()
+    count = db.session.execute(text(
+        'SELECT COUNT(*) FROM {} WHERE category = :category'.format(table)),
+        {'category': category}).scalar()
+    return page, count
+
+
+def quiz(table, category, columns='*'):
+    return db.session.execute(text(
+        'SELECT {} FROM {} WHERE category = :category AND id NOT IN ({}) '
+        .format(columns, table, ', '.join(str(i) for i in PREVIOUS))),
+        {'category': category}).fetchall()
+
+
+def run(size, repeat):
+    app = sqlite_app()
+    with app.app_context():
+        seed(size)
+        create_legacy()
+        methods = [
+            ('listing before', lambda: listing(
+                'questions_legacy', str(CATEGORY))),
+            ('listing after', lambda: listing('questions', CATEGORY)),
+            ('quiz before', lambda: quiz('questions_legacy', str(CATEGORY))),
+            # The quiz only needs candidate ids, read from the index
+            ('quiz after', lambda: quiz('questions', CATEGORY, 'id')),
+        ]
+        for name, fn in methods:
+            report(size, name, *measure(fn, repeat))
+        drop_sqlite(app)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.size, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
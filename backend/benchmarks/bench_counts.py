@@ -0,0 +1,45 @@
+"""
+Benchmark of the ways to compute total_questions.
+
+Compares loading every row (the old len(Question.query.all())), a
+server-side COUNT(*) and the in-memory question_counts cache on a
+SQLite database seeded with synthetic questions.
+
+Run from the backend folder:
+    python -m benchmarks.bench_counts --sizes 1000,100000,1000000
+"""
+import argparse
+
+from models import Question
+from counts import question_counts, count_query
+from benchmarks.common import sqlite_app, drop_sqlite, measure, report
+from benchmarks.data import seed
+
+
+def run(size, repeat):
+    app = sqlite_app()
+    with app.app_context():
+        seed(size)
+        question_counts.invalidate()
+        question_counts.total()
+        methods = [
+            ('full load', lambda: len(Question.query.all())),
+            ('COUNT(*)', lambda: count_query(Question.query)),
+            ('cached', question_counts.total),
+        ]
+        for name, fn in methods:
+            report(size, name, *measure(fn, repeat))
+        drop_sqlite(app)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    for size in args.sizes.split(','):
+        run(int(size), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
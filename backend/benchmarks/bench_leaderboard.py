@@ -0,0 +1,100 @@
+"""
+Benchmark of score submission and leaderboard reads.
+
+Compares committing every submitted score with the write-behind
+leaderboard, which ranks them in memory and writes them in batches,
+then compares reading the top 100 players with a grouped ORDER BY
+query and from the in-memory ranking.
+
+Run from the backend folder:
+    python -m benchmarks.bench_leaderboard --sizes 1000,100000
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import func
+
+from models import db, Score
+from leaderboard import Leaderboard, UPSERT_SCORES
+from benchmarks.common import sqlite_app, drop_sqlite, measure, report
+from benchmarks.data import seed
+
+CATEGORIES = 6
+
+
+def submissions(players, count, seed):
+    rng = random.Random(seed)
+    return [('player{}'.format(rng.randrange(players)),
+             rng.randint(0, CATEGORIES), rng.randint(0, 5))
+            for _ in range(count)]
+
+
+def commit_each(scores):
+    for player, category, points in scores:
+        db.session.execute(UPSERT_SCORES, {
+            'player': player, 'category': category, 'points': points,
+            'games': 1})
+        db.session.commit()
+
+
+def write_behind(leaderboard, scores, flush_every):
+    for index, (player, category, points) in enumerate(scores, 1):
+        leaderboard.submit(player, category or None, points)
+        if index % flush_every == 0:
+            leaderboard.flush()
+    leaderboard.flush()
+
+
+def top_query(count):
+    return db.session.query(Score.player, func.sum(Score.points).label(
+        'points')).group_by(Score.player).order_by(
+        func.sum(Score.points).desc(), Score.player).limit(count).all()
+
+
+def report_rate(size, name, count, seconds):
+    print('{:>9} rows  {:<24} {:>10.0f} submits/s'.format(
+        size, name, count / seconds))
+
+
+def run(size, submits, flush_every, repeat):
+    app = sqlite_app()
+    with app.app_context():
+        seed(0)
+        # Every player has played once before the timed submissions
+        leaderboard = Leaderboard()
+        write_behind(leaderboard, [
+            ('player{}'.format(i), i % (CATEGORIES + 1), i % 6)
+            for i in range(size)], flush_every)
+
+        scores = submissions(size, submits, 0)
+        start = time.perf_counter()
+        commit_each(scores)
+        report_rate(size, 'commit each', submits,
+                    time.perf_counter() - start)
+        start = time.perf_counter()
+        write_behind(leaderboard, scores, flush_every)
+        report_rate(size, 'write-behind', submits,
+                    time.perf_counter() - start)
+
+        report(size, 'top 100 query', *measure(
+            lambda: top_query(100), repeat))
+        report(size, 'top 100 ranked list', *measure(
+            lambda: leaderboard.top(None, 100), repeat))
+        drop_sqlite(app)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,100000',
+                        help='numbers of players')
+    parser.add_argument('--submits', type=int, default=2000)
+    parser.add_argument('--flush-every', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    for size in args.sizes.split(','):
+        run(int(size), args.submits, args.flush_every, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Benchmark of OFFSET and keyset pagination of the question list.
+
+Times page 1 and a deep page with Query.paginate (OFFSET plus its
+hidden count query), plain LIMIT/OFFSET and keyset pagination
+(WHERE id > after LIMIT n).
+
+Run from the backend folder:
+    python -m benchmarks.bench_pagination --size 200000 --pages 1,10000
+"""
+import argparse
+
+from models import Question
+from flaskr import paginate, QUESTIONS_PER_PAGE
+from benchmarks.common import sqlite_app, drop_sqlite, measure, report
+from benchmarks.data import seed
+
+
+def keyset(after):
+    return Question.query.order_by(Question.id).filter(
+        Question.id > after).limit(QUESTIONS_PER_PAGE).all()
+
+
+def run(size, pages, repeat):
+    app = sqlite_app()
+    with app.app_context():
+        seed(size)
+        query = Question.query.order_by(Question.id)
+        for page in pages:
+            # Seeded ids are sequential, so the cursor of a page is known
+            after = (page - 1) * QUESTIONS_PER_PAGE
+            methods = [
+                ('paginate()', lambda: query.paginate(
+                    page=page, per_page=QUESTIONS_PER_PAGE).items),
+                ('offset', lambda: paginate(query, page)),
+                ('keyset', lambda: keyset(after)),
+            ]
+            for name, fn in methods:
+                report(size, 'p{} {}'.format(page, name),
+                       *measure(fn, repeat))
+        drop_sqlite(app)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=200000)
+    parser.add_argument('--pages', default='1,10000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    pages = [int(page) for page in args.pages.split(',')]
+    run(args.size, pages, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Benchmark of question search.
+
+Times building the in-memory inverted index and compares its query
+latency with the old leading-wildcard ILIKE scan (page plus count).
+
+Run from the backend folder:
+    python -m benchmarks.bench_search --sizes 1000,100000
+"""
+import argparse
+import time
+
+from models import Question
+from search import MemorySearch
+from benchmarks.common import sqlite_app, drop_sqlite, measure, report
+from benchmarks.data import seed
+
+TERMS = ['river', 'famous painter', 'isl', 'which king won']
+
+
+def ilike(term):
+    query = Question.query.order_by(Question.id).filter(
+        Question.question.ilike('%{}%'.format(term)))
+    query.limit(10).all()
+    return len(query.all())
+
+
+def run(size, repeat):
+    app = sqlite_app()
+    with app.app_context():
+        seed(size)
+        index = MemorySearch()
+        start = time.perf_counter()
+        index.build()
+        report(size, 'index build',
+               (time.perf_counter() - start) * 1000, 0)
+        for term in TERMS:
+            report(size, 'ilike ' + term, *measure(
+                lambda: ilike(term), repeat))
+            report(size, 'index ' + term, *measure(
+                lambda: index.search(term), repeat))
+        drop_sqlite(app)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,100000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    for size in args.sizes.split(','):
+        run(int(size), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmark of JSON serialization of questions and categories.
+
+Compares the rows per second of loading ORM objects, calling format()
+and encoding with the standard library (the old path), with selecting
+column tuples and encoding them with serialize.dumps, which uses orjson
+when it is installed.
+
+Run from the backend folder:
+    python -m benchmarks.bench_serialize --sizes 1000,100000
+"""
+import argparse
+import json
+
+from models import Question, Category
+from serialize import (JSON_BACKEND, question_query, category_query,
+                       format_questions, format_categories, dumps)
+from benchmarks.common import sqlite_app, drop_sqlite, measure
+from benchmarks.data import seed
+
+
+def orm(model):
+    return json.dumps([item.format() for item in model.query.order_by(
+        model.id)], sort_keys=True, indent=2).encode('utf-8')
+
+
+def tuples(query, format_rows, model):
+    return dumps(format_rows(query().order_by(model.id)))
+
+
+def report_rate(size, name, rows, latency, memory):
+    print('{:>9} rows  {:<28} {:>12.0f} rows/s {:>12.1f} KiB'.format(
+        size, name, rows / latency * 1000 if latency else 0, memory))
+
+
+def run(size, repeat):
+    app = sqlite_app()
+    with app.app_context():
+        seed(size)
+        categories = Category.query.count()
+        for name, rows, model, query, format_rows in [
+                ('questions', size, Question, question_query,
+                 format_questions),
+                ('categories', categories, Category, category_query,
+                 format_categories)]:
+            report_rate(size, name + ' orm+format', rows, *measure(
+                lambda: orm(model), repeat))
+            report_rate(size, '{} tuples+{}'.format(name, JSON_BACKEND),
+                        rows, *measure(
+                            lambda: tuples(query, format_rows, model),
+                            repeat))
+        drop_sqlite(app)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,100000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    for size in args.sizes.split(','):
+        run(int(size), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
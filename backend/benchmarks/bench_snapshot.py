@@ -0,0 +1,132 @@
+"""
+Benchmark of serving from a snapshot file instead of the database.
+
+Exports a seeded SQLite database to a snapshot, checks that both apps
+return the same bytes, then starts each app in a fresh process and
+reports the time to build it and serve its first requests, and the
+resident memory of the process (and its growth since the imports)
+once they are served. The database app is measured cold and with
+its caches warmed at boot.
+
+Run from the backend folder:
+    python -m benchmarks.bench_snapshot --sizes 1000,100000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import sqlite_app, drop_sqlite
+from benchmarks.data import seed
+
+URLS = ['/categories', '/questions', '/questions?page=3',
+        '/categories/1/questions', '/categories/2/questions?after=100&limit=5',
+        '/questions/export']
+
+QUIZ = {'quiz_category': {'type': 'Science', 'id': 0},
+        'previous_questions': []}
+
+
+def rss_kib():
+    """Returns the resident memory of this process in KiB."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # Peak memory, in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def child(mode, database, snapshot):
+    """Builds one app, serves its first requests and prints the costs."""
+    from flaskr import create_app
+    baseline = rss_kib()
+    start = time.perf_counter()
+    if mode == 'snapshot':
+        app = create_app({'SNAPSHOT_PATH': snapshot})
+    else:
+        app = create_app({'SQLALCHEMY_DATABASE_URI': database},
+                         warm=mode == 'db warm')
+    boot = time.perf_counter() - start
+    client = app.test_client()
+    for url in URLS[:4]:
+        client.get(url)
+    client.post('/quizzes', json=QUIZ)
+    first = time.perf_counter() - start - boot
+    rss = rss_kib()
+    print(json.dumps({'boot_ms': boot * 1000, 'first_ms': first * 1000,
+                      'rss_kib': rss, 'growth_kib': rss - baseline}))
+
+
+def measure_child(mode, database, snapshot):
+    output = subprocess.check_output([
+        sys.executable, '-m', 'benchmarks.bench_snapshot', '--child', mode,
+        '--database', database, '--snapshot', snapshot])
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def compare(database, snapshot):
+    """Returns the number of URLs answered with the same bytes."""
+    from flaskr import create_app
+    clients = [create_app({'SQLALCHEMY_DATABASE_URI': database}).test_client(),
+               create_app({'SNAPSHOT_PATH': snapshot}).test_client()]
+    identical = 0
+    for url in URLS:
+        db_response, snapshot_response = [client.get(url) for client in clients]
+        if db_response.data != snapshot_response.data:
+            print('  {} differs'.format(url))
+        else:
+            identical += 1
+    return identical
+
+
+def run(size):
+    from snapshot import write_snapshot
+    app = sqlite_app()
+    database = app.config['SQLALCHEMY_DATABASE_URI']
+    snapshot = os.path.join(tempfile.mkdtemp(), 'trivia.snapshot')
+    with app.app_context():
+        seed(size)
+        start = time.perf_counter()
+        write_snapshot(snapshot)
+        export = time.perf_counter() - start
+    print('{:>9} rows  export {:.0f} ms, {:.1f} KiB snapshot, '
+          '{} of {} responses identical'.format(
+              size, export * 1000, os.path.getsize(snapshot) / 1024,
+              compare(database, snapshot), len(URLS)))
+
+    for mode in ['db', 'db warm', 'snapshot']:
+        costs = measure_child(mode, database, snapshot)
+        print('{:>9} rows  {:<10} boot {:>9.1f} ms  first requests {:>9.1f} ms'
+              '  RSS {:>9.0f} KiB (+{:.0f})'.format(
+                  size, mode, costs['boot_ms'], costs['first_ms'],
+                  costs['rss_kib'], costs['growth_kib']))
+    with app.app_context():
+        drop_sqlite(app)
+    os.remove(snapshot)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,100000')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    parser.add_argument('--snapshot', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.database, args.snapshot)
+        return
+    for size in args.sizes.split(','):
+        run(int(size))
+
+
+if __name__ == '__main__':
+    main()
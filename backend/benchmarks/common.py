@@ -0,0 +1,48 @@
+"""
+Helpers shared by the benchmark scripts.
+"""
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from flask import Flask
+
+from models import setup_db, init_db, db
+
+
+def sqlite_app():
+    """Returns a Flask app bound to a new SQLite database file."""
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app = Flask(__name__)
+    setup_db(app, 'sqlite:///' + path)
+    with app.app_context():
+        init_db()
+    app.config['BENCH_DB_FILE'] = path
+    return app
+
+
+def drop_sqlite(app):
+    db.session.remove()
+    os.remove(app.config['BENCH_DB_FILE'])
+
+
+def measure(fn, repeat):
+    """Returns the median latency in ms and peak memory in KiB of fn."""
+    timings = []
+    peak = 0
+    for _ in range(repeat):
+        db.session.expunge_all()
+        tracemalloc.start()
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return statistics.median(timings), peak / 1024
+
+
+def report(size, name, latency, memory):
+    print('{:>9} rows  {:<24} {:>10.3f} ms {:>12.1f} KiB'.format(
+        size, name, latency, memory))
@@ -0,0 +1,111 @@
+"""
+Synthetic trivia data shaped like trivia.psql.
+
+Uses the categories of the dump and gives the generated questions the
+same mix of categories and difficulties as its questions, scaled to any
+number of rows. The text is drawn from a small vocabulary so the search
+index has realistic posting lists.
+
+Load a database from the backend folder, SQLite or a scratch Postgres
+database whose tables are dropped first:
+    python -m benchmarks.data --database sqlite:////tmp/trivia.db --size 100000
+"""
+import argparse
+import os
+import random
+import re
+
+from flask import Flask
+
+from models import (setup_db, db, Question, Category,
+                    notify_question_change, notify_category_change)
+
+BATCH_SIZE = 10000
+
+TRIVIA_DUMP = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'trivia.psql')
+
+WORDS = (
+    'which what who where famous river city painter country team movie '
+    'ocean planet king queen war year first largest smallest oldest '
+    'invented discovered wrote played won capital island mountain lake '
+    'element animal author song album book sport olympic world cup'
+).split()
+
+
+def read_table(dump, table):
+    """Returns the rows of a table's COPY block in a pg_dump file."""
+    match = re.search(r'COPY public\.{} .*?stdin;\n(.*?)\n\\\.'.format(table),
+                      dump, re.S)
+    return [line.split('\t') for line in match.group(1).split('\n')]
+
+
+def read_dump(path=TRIVIA_DUMP):
+    """
+    Returns the categories of the dump as (id, type) pairs and the
+    (category, difficulty) pairs of its questions.
+    """
+    with open(path, encoding='utf-8') as f:
+        dump = f.read()
+    categories = [(int(id), type) for id, type in read_table(
+        dump, 'categories')]
+    shapes = [(int(category), int(difficulty)) for
+              id, question, answer, difficulty, category in read_table(
+                  dump, 'questions')]
+    return categories, shapes
+
+
+def question_text(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(6, 12))]
+    return ' '.join(words).capitalize() + '?'
+
+
+def seed(size):
+    """
+    Inserts the trivia.psql categories and size synthetic questions,
+    then tells the in-memory caches and indexes to reload.
+    """
+    categories, shapes = read_dump()
+    db.session.execute(Category.__table__.insert(), [
+        {'id': id, 'type': type} for id, type in categories])
+
+    rng = random.Random(size)
+    table = Question.__table__
+    for start in range(0, size, BATCH_SIZE):
+        rows = []
+        for i in range(start, min(start + BATCH_SIZE, size)):
+            category, difficulty = shapes[i % len(shapes)]
+            rows.append({
+                'question': question_text(rng),
+                'answer': '{} {}'.format(rng.choice(WORDS), i).capitalize(),
+                'category': category,
+                'difficulty': difficulty
+            })
+        db.session.execute(table.insert(), rows)
+    db.session.commit()
+    notify_category_change('bulk', None)
+    notify_question_change('bulk', None)
+
+
+def load(database_uri, size):
+    """Recreates the tables of a database and seeds them."""
+    app = Flask(__name__)
+    setup_db(app, database_uri)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(size)
+        db.session.remove()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', required=True)
+    parser.add_argument('--size', type=int, default=1000)
+    args = parser.parse_args()
+    load(args.database, args.size)
+
+
+if __name__ == '__main__':
+    main()
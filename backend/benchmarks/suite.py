@@ -0,0 +1,305 @@
+"""
+Benchmark suite of the API endpoints.
+
+For every size, loads a database with benchmarks.data, then runs
+  * micro: each endpoint called in turn through the Flask test client
+  * load: a mix of the endpoints sent by concurrent clients
+and reports the p50/p95/p99 latency and requests per second of each
+endpoint. The results can be written as JSON and compared with an
+earlier run to catch regressions.
+
+Run from the backend folder, against SQLite (the default) or a scratch
+Postgres database whose tables are dropped:
+    python -m benchmarks.suite --sizes 1000,100000 --output results.json
+    python -m benchmarks.suite --database postgresql://localhost/bench
+    python -m benchmarks.suite --compare results.json --tolerance 0.25
+
+The load test can instead target an API already running on this
+machine, loaded beforehand with benchmarks.data:
+    python -m benchmarks.suite --mode load --url http://127.0.0.1:5000
+"""
+import argparse
+import datetime
+import http.client
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from flaskr import create_app
+from benchmarks.data import load, WORDS
+
+RESULTS_VERSION = 1
+
+# App config turning admission control off, as the benchmarks would
+# otherwise mostly time 429 and 503 responses
+NO_ADMISSION_LIMITS = {'RATE_LIMIT_PER_MINUTE': 0, 'DB_CONCURRENCY_LIMIT': 0}
+
+
+def scenarios(size):
+    """
+    Returns the benchmarked requests as (name, method, path, body
+    factory) tuples. Body factories take a random generator.
+    """
+    deep_page = max(1, size // 20)
+    return [
+        ('categories', 'GET', lambda rng: ('/categories', None)),
+        ('questions', 'GET', lambda rng: ('/questions', None)),
+        ('questions deep page', 'GET', lambda rng: (
+            '/questions?page={}'.format(deep_page), None)),
+        ('questions cursor', 'GET', lambda rng: (
+            '/questions?after={}&limit=10'.format(deep_page * 10), None)),
+        ('category questions', 'GET', lambda rng: (
+            '/categories/{}/questions'.format(rng.randint(1, 6)), None)),
+        ('search', 'POST', lambda rng: ('/questions/search', {
+            'searchTerm': ' '.join(rng.sample(WORDS, 2))})),
+        ('quizzes', 'POST', lambda rng: ('/quizzes', {
+            'previous_questions': rng.sample(range(1, size + 1),
+                                             min(5, size)),
+            'quiz_category': {'type': 'Science', 'id': rng.randint(0, 5)}})),
+        ('quiz round', 'POST', lambda rng: ('/quizzes/round', {
+            'previous_questions': [],
+            'quiz_category': {'type': 'Science', 'id': rng.randint(0, 5)},
+            'count': 5})),
+    ]
+
+
+def summarize(latencies, errors, seconds):
+    """Returns the statistics of a list of latencies in seconds."""
+    values = sorted(latency * 1000 for latency in latencies)
+
+    def percentile(rank):
+        if not values:
+            return 0
+        return round(values[max(0, -(-rank * len(values) // 100) - 1)], 3)
+
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'p50_ms': percentile(50),
+        'p95_ms': percentile(95),
+        'p99_ms': percentile(99),
+        'mean_ms': round(sum(values) / len(values), 3) if values else 0,
+        'rps': round(len(values) / seconds, 1) if seconds else 0,
+    }
+
+
+"""
+TestClientTarget
+    sends requests to an app in this process through its test client
+"""
+class TestClientTarget:
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, path, body):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        response = self.local.client.open(path, method=method, json=body)
+        response.get_data()
+        return response.status_code
+
+
+"""
+HTTPTarget
+    sends requests to an API server running on this machine
+"""
+class HTTPTarget:
+
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.local = threading.local()
+
+    def request(self, method, path, body):
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=30)
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.local.connection.request(method, path, data, headers)
+            response = self.local.connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            del self.local.connection
+            raise
+        return response.status
+
+
+# Scenarios answering 404 once a category has no questions left
+QUIZ_SCENARIOS = {'quizzes', 'quiz round'}
+
+
+def is_error(name, status):
+    if status == 404 and name in QUIZ_SCENARIOS:
+        return False
+    return status >= 400
+
+
+def run_micro(target, size, iterations, seed):
+    rng = random.Random(seed)
+    results = {}
+    for name, method, request in scenarios(size):
+        latencies = []
+        errors = 0
+        started = time.perf_counter()
+        for _ in range(iterations):
+            path, body = request(rng)
+            start = time.perf_counter()
+            status = target.request(method, path, body)
+            latencies.append(time.perf_counter() - start)
+            errors += is_error(name, status)
+        results[name] = summarize(
+            latencies, errors, time.perf_counter() - started)
+    return results
+
+
+def run_load(target, size, concurrency, requests, seed):
+    """
+    Sends requests requests spread over concurrency threads, each
+    picking random endpoints, and returns the statistics per endpoint
+    and overall.
+    """
+    plan = scenarios(size)
+    latencies = {name: [] for name, method, request in plan}
+    errors = {name: 0 for name, method, request in plan}
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def client(index):
+        rng = random.Random(seed + index)
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            name, method, request = rng.choice(plan)
+            path, body = request(rng)
+            start = time.perf_counter()
+            try:
+                failed = is_error(name, target.request(method, path, body))
+            except Exception:
+                failed = True
+            latency = time.perf_counter() - start
+            with lock:
+                latencies[name].append(latency)
+                errors[name] += failed
+
+    threads = [threading.Thread(target=client, args=(index,))
+               for index in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    results = {name: summarize(latencies[name], errors[name], seconds)
+               for name in latencies}
+    results['all'] = summarize(
+        [latency for values in latencies.values() for latency in values],
+        sum(errors.values()), seconds)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the endpoints whose p95 latency grew by more than tolerance
+    since the baseline run and returns their number.
+    """
+    previous = {(run['size'], run['mode'], name): stats['p95_ms']
+                for run in baseline['runs']
+                for name, stats in run['results'].items()}
+    regressions = 0
+    for run in results['runs']:
+        for name, stats in run['results'].items():
+            before = previous.get((run['size'], run['mode'], name))
+            if before and stats['p95_ms'] > before * (1 + tolerance):
+                regressions += 1
+                print('REGRESSION {} rows {} {}: p95 {:.3f} ms -> {:.3f} ms'
+                      .format(run['size'], run['mode'], name, before,
+                              stats['p95_ms']))
+    return regressions
+
+
+def print_run(run):
+    print('{} rows, {}{}'.format(run['size'], run['mode'], (
+        ', {} clients'.format(run['concurrency'])
+        if 'concurrency' in run else '')))
+    for name, stats in run['results'].items():
+        print('  {:<22} p50 {:>9.3f} ms  p95 {:>9.3f} ms  p99 {:>9.3f} ms '
+              '{:>9.1f} req/s  {} errors'.format(
+                  name, stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+                  stats['rps'], stats['errors']))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,100000')
+    parser.add_argument('--database',
+                        help='Postgres URL, a new SQLite file by default')
+    parser.add_argument('--url', help='API server to load test instead')
+    parser.add_argument('--mode', choices=['micro', 'load', 'all'],
+                        default='all')
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output')
+    parser.add_argument('--compare')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    modes = ['micro', 'load'] if args.mode == 'all' else [args.mode]
+    results = {
+        'version': RESULTS_VERSION,
+        'created': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'database': 'server' if args.url else (
+            args.database.split(':')[0] if args.database else 'sqlite'),
+        'runs': [],
+    }
+
+    for size in [int(size) for size in args.sizes.split(',')]:
+        if args.url:
+            target = HTTPTarget(args.url)
+        else:
+            database = args.database or 'sqlite:///' + os.path.join(
+                tempfile.mkdtemp(), 'suite.db')
+            load(database, size)
+            target = TestClientTarget(create_app(dict(
+                NO_ADMISSION_LIMITS, SQLALCHEMY_DATABASE_URI=database)))
+        for mode in modes:
+            if mode == 'micro':
+                stats = run_micro(target, size, args.iterations, args.seed)
+            else:
+                stats = run_load(target, size, args.concurrency,
+                                 args.requests, args.seed)
+            run = {'size': size, 'mode': mode, 'results': stats}
+            if mode == 'load':
+                run['concurrency'] = args.concurrency
+            results['runs'].append(run)
+            print_run(run)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(results, json.load(f), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+import csv
+import io
+import json
+import time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Question, notify_question_change
+from serialize import dumps
+
+# Columns of an imported or exported question, in CSV order
+COLUMNS = ['question', 'answer', 'category', 'difficulty']
+EXPORT_COLUMNS = ['id'] + COLUMNS
+
+# Per-row errors returned by an import, the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+# Operations accepted in one batch request
+MAX_BATCH_OPERATIONS = 1000
+
+
+def read_rows(stream, content_type):
+    """
+    Yields (line number, row dict or None) for every line of an NDJSON
+    or CSV body as it is read from the stream. The row is None when the
+    line is not valid JSON.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if 'csv' in (content_type or ''):
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row
+
+
+def text_field(row, column):
+    """Returns the stripped text of a column, '' when it is missing."""
+    value = row.get(column)
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise ValueError('{} must be a string'.format(column))
+    return value.strip()
+
+
+def integer_field(row, column):
+    """Returns the integer of a column, also accepted as CSV text."""
+    value = row.get(column)
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            pass
+    elif isinstance(value, int) and not isinstance(value, bool):
+        return value
+    raise ValueError('{} must be an integer'.format(column))
+
+
+def validate(row, category_ids):
+    """
+    Returns the values to insert for a row, or raises ValueError with
+    the reason the row is invalid.
+    """
+    if not isinstance(row, dict):
+        raise ValueError('row is not a JSON object')
+    question = text_field(row, 'question')
+    answer = text_field(row, 'answer')
+    if not question or not answer:
+        raise ValueError('question and answer are required')
+    category = integer_field(row, 'category')
+    difficulty = integer_field(row, 'difficulty')
+    if category not in category_ids:
+        raise ValueError('category {} does not exist'.format(category))
+    if not 1 <= difficulty <= 5:
+        raise ValueError('difficulty must be between 1 and 5')
+    return {
+        'question': question,
+        'answer': answer,
+        'category': category,
+        'difficulty': difficulty
+    }
+
+
+def copy_batch(batch):
+    """Loads a batch with Postgres COPY through the session connection."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        writer.writerow([row[column] for column in COLUMNS])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(
+        'COPY questions ({}) FROM STDIN WITH (FORMAT csv)'.format(
+            ', '.join(COLUMNS)), buffer)
+
+
+def insert_batch(batch):
+    if db.engine.dialect.name == 'postgresql':
+        copy_batch(batch)
+    else:
+        db.session.execute(Question.__table__.insert(), batch)
+    db.session.commit()
+
+
+"""
+import_questions(stream, content_type, category_ids, batch_size)
+    validates the rows of a streamed NDJSON or CSV body one at a time
+    and inserts the valid ones in batches, one transaction per batch.
+    A body that cannot be decoded stops the import, keeping the
+    batches already inserted.
+    Returns the import statistics with the errors of invalid rows.
+"""
+def import_questions(stream, content_type, category_ids, batch_size):
+    start = time.perf_counter()
+    inserted = 0
+    failed = 0
+    errors = []
+    batch = []
+    line_number = 0
+    completed = True
+    try:
+        try:
+            for line_number, row in read_rows(stream, content_type):
+                try:
+                    batch.append(validate(row, category_ids))
+                except ValueError as e:
+                    failed += 1
+                    if len(errors) < MAX_REPORTED_ERRORS:
+                        errors.append({'line': line_number, 'error': str(e)})
+                    continue
+                if len(batch) >= batch_size:
+                    insert_batch(batch)
+                    inserted += len(batch)
+                    batch = []
+        except (UnicodeDecodeError, csv.Error) as e:
+            # The rest of the body cannot be read, the rows read before
+            # it are still inserted
+            completed = False
+            errors.append({'line': line_number + 1, 'error': str(e)})
+        if batch:
+            insert_batch(batch)
+            inserted += len(batch)
+    finally:
+        if inserted:
+            notify_question_change('bulk', None)
+
+    seconds = time.perf_counter() - start
+    return {
+        'inserted': inserted,
+        'failed': failed,
+        'errors': errors,
+        'completed': completed,
+        'batches': -(-inserted // batch_size),
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(inserted / seconds) if seconds else inserted
+    }
+
+
+def apply_operation(operation, category_ids):
+    """
+    Applies a create, update or delete operation in the session and
+    returns the id of its question, or raises ValueError with the
+    reason the operation is invalid.
+    """
+    if not isinstance(operation, dict):
+        raise ValueError('operation is not a JSON object')
+    op = operation.get('op')
+    if op == 'create':
+        question = Question(**validate(operation, category_ids))
+        db.session.add(question)
+        db.session.flush()
+        return question.id
+    if op not in ('update', 'delete'):
+        raise ValueError('op must be create, update or delete')
+
+    question_id = integer_field(operation, 'id')
+    question = Question.query.get(question_id)
+    if question is None:
+        raise ValueError('question {} does not exist'.format(question_id))
+    if op == 'delete':
+        db.session.delete(question)
+    else:
+        # Unchanged columns keep their values and are validated again
+        row = question.format()
+        row.update((column, operation[column]) for column in COLUMNS
+                   if column in operation)
+        for column, value in validate(row, category_ids).items():
+            setattr(question, column, value)
+    db.session.flush()
+    return question_id
+
+
+"""
+apply_batch(operations, category_ids, atomic)
+    applies a list of create, update and delete operations in a
+    single transaction, each in its own savepoint so an invalid one
+    is rolled back alone and reported. With atomic, the transaction
+    is rolled back when any operation failed. The derived data is
+    reloaded once, after the commit.
+    Returns the result of every operation.
+"""
+def apply_batch(operations, category_ids, atomic=False):
+    results = []
+    applied = 0
+    try:
+        for index, operation in enumerate(operations):
+            savepoint = db.session.begin_nested()
+            try:
+                question_id = apply_operation(operation, category_ids)
+                savepoint.commit()
+            except (ValueError, SQLAlchemyError) as e:
+                savepoint.rollback()
+                results.append({'index': index, 'success': False,
+                                'error': str(e)})
+                continue
+            applied += 1
+            results.append({'index': index, 'success': True,
+                            'op': operation['op'], 'id': question_id})
+
+        failed = len(operations) - applied
+        committed = bool(applied) and not (atomic and failed)
+        if committed:
+            db.session.commit()
+        else:
+            db.session.rollback()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if committed:
+        notify_question_change('bulk', None)
+    return {
+        'results': results,
+        'applied': applied if committed else 0,
+        'failed': failed,
+        'committed': committed
+    }
+
+
+"""
+export_rows(rows, csv_format)
+    yields question rows, in EXPORT_COLUMNS order, as NDJSON lines, or
+    CSV with a header row
+"""
+def export_rows(rows, csv_format=False):
+    if csv_format:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() > 65536:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+        return
+
+    for row in rows:
+        yield dumps(dict(zip(EXPORT_COLUMNS, row)))
+
+
+"""
+export_questions(csv_format)
+    yields every question ordered by id as NDJSON lines, or CSV with a
+    header row, reading them through a server-side cursor so memory
+    use does not grow with the table
+"""
+def export_questions(csv_format=False, chunk_size=1000):
+    columns = [getattr(Question, column) for column in EXPORT_COLUMNS]
+    rows = db.session.query(*columns).order_by(Question.id).execution_options(
+        stream_results=True).yield_per(chunk_size)
+    return export_rows(rows, csv_format)
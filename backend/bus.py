@@ -0,0 +1,310 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+from collections import deque
+
+from sqlalchemy import text
+
+from profiling import percentile, PERCENTILES
+from settings import CHANGE_BUS, CHANGE_BUS_CHANNEL, CHANGE_BUS_POLL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Version of the change events, events of another version reload
+# every table as they cannot be trusted to be understood
+EVENT_VERSION = 1
+
+# Propagation latencies kept to compute the percentiles
+LATENCY_SAMPLES = 1000
+
+NOTIFY = text('SELECT pg_notify(:channel, :payload)').execution_options(
+    autocommit=True)
+
+
+"""
+MemoryBackend
+    delivers the change events to the other buses of this process, as
+    when the app runs on SQLite or in the tests. Events are applied by
+    the thread that published them.
+"""
+class MemoryBackend:
+
+    buses = []
+    lock = threading.Lock()
+
+    def __init__(self, bus):
+        self.bus = bus
+        with self.lock:
+            self.buses.append(bus)
+
+    def send(self, payload):
+        with self.lock:
+            buses = [bus for bus in self.buses if bus is not self.bus]
+        for bus in buses:
+            bus.receive([payload])
+
+    def stop(self):
+        with self.lock:
+            if self.bus in self.buses:
+                self.buses.remove(self.bus)
+
+
+"""
+PostgresBackend
+    sends the change events with NOTIFY on a channel of the database,
+    and LISTENs to it from a background thread holding a connection of
+    its own, outside the pool. The events that arrived together are
+    applied at once. When the connection is lost every table is
+    reloaded after each attempt to reconnect, so the caches are never
+    staler than poll_seconds while events may be missed.
+"""
+class PostgresBackend:
+
+    def __init__(self, bus, engine, channel=CHANGE_BUS_CHANNEL,
+                 poll_seconds=CHANGE_BUS_POLL_SECONDS):
+        self.bus = bus
+        self.engine = engine
+        self.channel = channel
+        self.poll_seconds = poll_seconds
+        self.stopped = threading.Event()
+        self.connected = False
+        self.reconnects = 0
+        self.listener = threading.Thread(target=self.run, daemon=True)
+        self.listener.start()
+
+    def send(self, payload):
+        with self.engine.connect() as connection:
+            connection.execute(NOTIFY, channel=self.channel, payload=payload)
+
+    def listen(self):
+        """Returns a DBAPI connection listening to the channel."""
+        connection = self.engine.raw_connection()
+        # Kept out of the pool for the life of the listener
+        connection.detach()
+        connection = connection.connection
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute('LISTEN "{}"'.format(
+                self.channel.replace('"', '""')))
+        return connection
+
+    def drain(self, connection):
+        connection.poll()
+        payloads = [notify.payload for notify in connection.notifies]
+        del connection.notifies[:]
+        if payloads:
+            self.bus.receive(payloads)
+
+    def run(self):
+        while not self.stopped.is_set():
+            connection = None
+            try:
+                connection = self.listen()
+                self.connected = True
+                # Events sent while nobody listened are lost
+                if self.reconnects:
+                    self.bus.reload()
+                while not self.stopped.is_set():
+                    if select.select([connection], [], [],
+                                     self.poll_seconds)[0]:
+                        self.drain(connection)
+                    else:
+                        # Finds out about a dead connection while idle
+                        with connection.cursor() as cursor:
+                            cursor.execute('SELECT 1')
+                        self.drain(connection)
+            except Exception as e:
+                logger.warning('Change bus listener failed: %s', e)
+                self.connected = False
+                self.reconnects += 1
+                self.bus.reload()
+                self.stopped.wait(self.poll_seconds)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+        self.connected = False
+
+    def stop(self):
+        self.stopped.set()
+
+    def status(self):
+        return {
+            'channel': self.channel,
+            'listening': self.connected,
+            'reconnects': self.reconnects
+        }
+
+
+"""
+ChangeBus
+    carries the question and category writes of this worker to the
+    other workers, which drop the caches derived from the written
+    table. An event is the JSON of its version, the origin worker and
+    its sequence number there, the table, id and op of the write and
+    the time it was committed. A worker ignores its own events, which
+    its listeners already applied, and reloads every table when it
+    missed an event of another worker. The time between the commit
+    and the apply of each event is kept to report the propagation
+    latency. A forked process is a new origin, whose backend and
+    listener start on its first request or write.
+"""
+class ChangeBus:
+
+    def __init__(self):
+        self.handlers = {}
+        # Backend and engine getter given to start, the backend is
+        # started in each process on first use
+        self.config = None
+        self.reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        """
+        Makes this process a new origin without a backend, as in a
+        worker forked from a preloaded app: the listener thread did not
+        survive the fork and the events of the parent are not its own.
+        """
+        self.lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        MemoryBackend.lock = threading.Lock()
+        self.origin = uuid.uuid4().hex
+        self.pid = None
+        self.seq = 0
+        self.backend = None
+        self.last_seq = {}
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.counts = {'published': 0, 'publish_errors': 0, 'received': 0,
+                       'duplicates': 0, 'gaps': 0, 'reloads': 0}
+
+    def subscribe(self, table, callback):
+        """Registers callback() to drop the caches derived from table."""
+        self.handlers.setdefault(table, []).append(callback)
+        return callback
+
+    def count(self, counter, n=1):
+        with self.lock:
+            self.counts[counter] += n
+
+    def start(self, backend=CHANGE_BUS, get_engine=None):
+        """
+        Sends and receives the events with backend: 'postgres', 'memory'
+        or 'off', 'auto' picking postgres on a Postgres engine. The
+        backend is started by the first request or write of the
+        process, see ensure_started, which calls get_engine() then so
+        the engine is built from the final configuration of the app.
+        Later calls replace the backend.
+        """
+        with self.start_lock:
+            self.stop()
+            self.config = (backend, get_engine)
+            self.pid = None
+
+    def ensure_started(self):
+        """Starts the backend of this process, if not already."""
+        if self.pid == os.getpid() or self.config is None:
+            return
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            backend, get_engine = self.config
+            engine = get_engine() if get_engine is not None else None
+            if backend == 'auto':
+                backend = ('postgres' if engine is not None and
+                           engine.dialect.name == 'postgresql' else 'memory')
+            if backend == 'postgres':
+                self.backend = PostgresBackend(self, engine)
+            elif backend == 'memory':
+                self.backend = MemoryBackend(self)
+            self.pid = os.getpid()
+
+    def stop(self):
+        if self.backend is not None:
+            self.backend.stop()
+            self.backend = None
+
+    def publish(self, table, id, op):
+        """Sends the event of a committed write to the other workers."""
+        self.ensure_started()
+        backend = self.backend
+        if backend is None:
+            return
+        with self.lock:
+            self.seq += 1
+            seq = self.seq
+        payload = json.dumps({
+            'v': EVENT_VERSION, 'origin': self.origin, 'seq': seq,
+            'table': table, 'id': id, 'op': op, 'ts': time.time()})
+        try:
+            backend.send(payload)
+            self.count('published')
+        except Exception as e:
+            # The write is committed, the others catch up on the next gap
+            logger.warning('Change bus publish failed: %s', e)
+            self.count('publish_errors')
+
+    def receive(self, payloads):
+        """Applies the events of other workers, once per table."""
+        tables = set()
+        now = time.time()
+        with self.lock:
+            for payload in payloads:
+                try:
+                    event = json.loads(payload)
+                except ValueError:
+                    event = {}
+                if event.get('v') != EVENT_VERSION:
+                    logger.warning('Unknown change event %r', payload)
+                    tables.update(self.handlers)
+                    continue
+                origin, seq = event['origin'], event['seq']
+                if origin == self.origin:
+                    continue
+                last = self.last_seq.get(origin)
+                if last is not None and seq <= last:
+                    self.counts['duplicates'] += 1
+                    continue
+                if last is not None and seq > last + 1:
+                    # Missed events may have written any table
+                    self.counts['gaps'] += 1
+                    tables.update(self.handlers)
+                self.last_seq[origin] = seq
+                self.counts['received'] += 1
+                self.latencies.append(max(0, now - event['ts']) * 1000)
+                tables.add(event['table'])
+        self.apply(tables)
+
+    def apply(self, tables):
+        for table in tables:
+            for callback in self.handlers.get(table, []):
+                callback()
+
+    def reload(self):
+        """Drops the caches of every table."""
+        self.count('reloads')
+        self.apply(list(self.handlers))
+
+    def status(self):
+        backend = self.backend
+        with self.lock:
+            latencies = sorted(self.latencies)
+            status = dict(self.counts)
+        status['backend'] = type(backend).__name__ if backend else None
+        if hasattr(backend, 'status'):
+            status.update(backend.status())
+        status['latency_ms'] = {
+            'p{}'.format(rank): round(percentile(latencies, rank), 3)
+            for rank in PERCENTILES}
+        status['latency_ms']['max'] = round(
+            latencies[-1], 3) if latencies else 0
+        return status
+
+
+change_bus = ChangeBus()
@@ -0,0 +1,235 @@
+import gzip
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+from flask import Response
+
+from models import Category, on_question_change, on_category_change
+from replicas import primary
+from settings import RESPONSE_CACHE_BYTES
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 256
+
+"""
+TableVersions
+    counts the writes to each table, so the data cached by this
+    process from a table can tell when it changed. The counts differ
+    between processes and never leave them.
+"""
+class TableVersions:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.versions = {}
+
+    def get(self, table):
+        return self.versions.get(table, 0)
+
+    def bump(self, table):
+        with self.lock:
+            self.versions[table] = self.versions.get(table, 0) + 1
+
+    def tag(self, *tables):
+        return '.'.join('{}{}'.format(table, self.get(table))
+                        for table in tables)
+
+
+table_versions = TableVersions()
+
+
+def body_etag(body):
+    """
+    Returns the ETag of a response body, the same in every process
+    serving the same content, so a client or CDN can revalidate
+    against any of them.
+    """
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+on_question_change(lambda op, question: table_versions.bump('questions'))
+on_category_change(lambda op, category: table_versions.bump('categories'))
+
+
+"""
+CategoryCache
+    read-through cache of the categories ordered by id, reloaded
+    when the categories table version changes
+"""
+class CategoryCache:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.categories = None
+        self.version = None
+
+    def all(self):
+        """Returns the (id, type) pairs of every category."""
+        with self.lock:
+            version = table_versions.get('categories')
+            if self.categories is None or self.version != version:
+                with primary():
+                    self.categories = [
+                        (category.id, category.type)
+                        for category in Category.query.order_by(Category.id)]
+                self.version = version
+            return self.categories
+
+    def types(self):
+        return [type for id, type in self.all()]
+
+    def get(self, category_id):
+        """Returns the type of a category, or None if it does not exist."""
+        for id, type in self.all():
+            if id == category_id:
+                return type
+        return None
+
+    def invalidate(self):
+        with self.lock:
+            self.categories = None
+
+
+category_cache = CategoryCache()
+
+
+"""
+CachedResponse
+    body of a response with its ETag and its gzip and brotli
+    encodings, kept only when they are smaller than the body
+"""
+class CachedResponse:
+    __slots__ = ('key', 'tables', 'etag', 'bodies', 'size')
+
+    def __init__(self, key, tables, body):
+        self.key = key
+        self.tables = tables
+        self.etag = body_etag(body)
+        self.bodies = {'identity': body}
+        if len(body) >= MIN_COMPRESS_BYTES:
+            encoded = {'gzip': gzip.compress(body, 6)}
+            if brotli is not None:
+                encoded['br'] = brotli.compress(body, quality=5)
+            for encoding, data in encoded.items():
+                if len(data) < len(body):
+                    self.bodies[encoding] = data
+        self.size = sum(len(data) for data in self.bodies.values())
+
+    def encoding(self, accept_encodings):
+        """
+        Returns the encoding the client prefers among those kept,
+        brotli first on a tie and identity when it accepts none.
+        """
+        best, best_quality = 'identity', 0
+        for encoding in ('br', 'gzip'):
+            quality = accept_encodings[encoding]
+            if encoding in self.bodies and quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def response(self, encoding):
+        response = Response(self.bodies[encoding],
+                            mimetype='application/json')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+"""
+ResponseCache
+    LRU cache of GET response bodies keyed by the path and the
+    versions of the tables they were built from. The
+    least recently used responses are dropped beyond max_bytes, and a
+    write to a table drops the responses built from it. Every app has
+    its own cache, as apps on different databases share table versions.
+"""
+class ResponseCache:
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_BYTES):
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        # Keys of the entries built from each table
+        self.keys = {}
+        self.bytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0,
+                      'invalidations': 0}
+        self.served = {}
+        response_caches.add(self)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry
+
+    def put(self, key, tables, body):
+        """Caches a body and returns its entry, kept only if it fits."""
+        entry = CachedResponse(key, tables, body)
+        if entry.size > self.max_bytes:
+            return entry
+        with self.lock:
+            self.remove(key)
+            self.entries[key] = entry
+            self.bytes += entry.size
+            for table in tables:
+                self.keys.setdefault(table, set()).add(key)
+            while self.bytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.stats['evictions'] += 1
+        return entry
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry.size
+        for table in entry.tables:
+            self.keys.get(table, set()).discard(key)
+
+    def invalidate(self, table):
+        with self.lock:
+            keys = self.keys.pop(table, set())
+            for key in keys:
+                self.remove(key)
+            self.stats['invalidations'] += len(keys)
+
+    def count_served(self, encoding):
+        with self.lock:
+            self.served[encoding] = self.served.get(encoding, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys.clear()
+            self.bytes = 0
+
+    def status(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries),
+                        bytes=self.bytes, max_bytes=self.max_bytes,
+                        served=dict(self.served),
+                        brotli=brotli is not None)
+
+
+# Response caches of the apps, dropped along with their app
+response_caches = weakref.WeakSet()
+
+
+def invalidate_responses(table):
+    for response_cache in list(response_caches):
+        response_cache.invalidate(table)
+
+
+on_question_change(lambda op, question: invalidate_responses('questions'))
+on_category_change(lambda op, category: invalidate_responses('categories'))
@@ -0,0 +1,73 @@
+import threading
+from sqlalchemy import func
+
+from models import db, Question, on_question_change
+from replicas import primary
+
+"""
+QuestionCounts
+    keeps the number of questions per category in memory.
+    The counts are loaded with a single grouped COUNT(*) query the
+    first time they are needed and then kept up to date by the
+    question write hooks, so listing endpoints never have to load
+    the questions table just to count it.
+"""
+class QuestionCounts:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_category = None
+
+    def load(self):
+        # Loaded from the primary, the write hooks then keep it current
+        with primary():
+            rows = db.session.query(
+                Question.category, func.count(Question.id)).group_by(
+                Question.category).all()
+        return {str(category): count for category, count in rows}
+
+    def counts(self):
+        with self.lock:
+            if self.by_category is None:
+                self.by_category = self.load()
+            return self.by_category
+
+    def total(self):
+        return sum(self.counts().values())
+
+    def category(self, category_id):
+        return self.counts().get(str(category_id), 0)
+
+    def invalidate(self):
+        with self.lock:
+            self.by_category = None
+
+    def changed(self, op, question):
+        with self.lock:
+            if self.by_category is None:
+                return
+            if op == 'insert':
+                key = str(question.category)
+                self.by_category[key] = self.by_category.get(key, 0) + 1
+            elif op == 'delete':
+                key = str(question.category)
+                self.by_category[key] = self.by_category.get(key, 1) - 1
+            else:
+                # An update may have moved the question to another
+                # category and a bulk write changed many, reload on
+                # next read
+                self.by_category = None
+
+
+question_counts = QuestionCounts()
+on_question_change(question_counts.changed)
+
+
+"""
+count_query(query)
+    runs COUNT(*) for a query on the database server instead of
+    loading and counting its rows
+"""
+def count_query(query):
+    return query.order_by(None).with_entities(
+        func.count(Question.id)).scalar()
@@ -1,17 +1,481 @@
 import os
-from flask import Flask, request, abort, jsonify
+import bisect
+import functools
+import heapq
+import math
+import click
+from flask import (Flask, request, abort, g, Response, stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
 
-from models import setup_db, Question, Category
+from models import setup_db, init_db, db, database_path, Question, Category
+from counts import question_counts
+from quiz import (quiz_index, next_question, next_round, target_difficulty,
+                  choose_question_id, choose_question_ids)
+from sessions import session_store
+from leaderboard import (leaderboard, LEADERBOARD_SIZE, MAX_LEADERBOARD_SIZE,
+                         MAX_PLAYER_LENGTH)
+from search import search_index
+from cache import (table_versions, category_cache, ResponseCache,
+                   body_etag)
+from serialize import (question_query, format_question, format_questions,
+                       json_response)
+from bulk import (import_questions, export_questions, export_rows,
+                  apply_batch, MAX_BATCH_OPERATIONS)
+from pool import pool_status
+from admission import AdmissionControl
+from snapshot import Snapshot, SnapshotQuizIndex, write_snapshot
+from replicas import read_only, pin_writers, replica_set, served_by_replica
+from bus import change_bus
+from profiling import (init_profiling, listen_queries, request_profiler,
+                       BootProfile)
+from settings import (CACHE_MAX_AGE, BULK_BATCH_SIZE, PROFILING,
+                      SLOW_QUERY_MS, DB_REPLICA_URLS, WARM_CACHES,
+                      SEARCH_BACKEND, SNAPSHOT_PATH, RATE_LIMIT_PER_MINUTE,
+                      RATE_LIMIT_BURST, DB_CONCURRENCY_LIMIT,
+                      RESPONSE_CACHE_BYTES, CHANGE_BUS)
 
 QUESTIONS_PER_PAGE = 10
+MAX_QUESTIONS_PER_PAGE = 100
 
-def create_app(test_config=None):
+# Questions of a quiz round, as played by the quiz view
+QUIZ_ROUND_SIZE = 5
+MAX_QUIZ_ROUND_SIZE = 50
+
+ERROR_MESSAGES = {
+    400: 'Bad request',
+    404: 'resource not found',
+    405: 'method not allowed',
+    422: 'resource unprocessable',
+    429: 'too many requests',
+    503: 'service unavailable',
+}
+
+"""
+paginate(query, page)
+    returns the questions of the requested page using LIMIT/OFFSET,
+    without the extra count query that Query.paginate issues
+"""
+def paginate(query, page):
+    if page < 1:
+        abort(404)
+    items = query.limit(QUESTIONS_PER_PAGE).offset(
+        (page - 1) * QUESTIONS_PER_PAGE).all()
+    if not items and page != 1:
+        abort(404)
+    return items
+
+
+"""
+paginate_request(query)
+    pages through a query ordered by question id. Uses keyset
+    pagination (WHERE id > after LIMIT n) when the request has
+    ?after=<id>&limit=<n> and the page parameter otherwise.
+    Returns the questions and the cursor of the next page.
+"""
+def paginate_request(query):
+    after = request.args.get('after', type=int)
+    if after is None:
+        limit = QUESTIONS_PER_PAGE
+        items = paginate(query, request.args.get('page', 1, type=int))
+    else:
+        limit = cursor_limit()
+        items = query.filter(Question.id > after).limit(limit).all()
+
+    next_cursor = items[-1].id if len(items) == limit else None
+    return items, next_cursor
+
+
+"""
+response_key(*tables)
+    returns the key of a GET response built from the given tables in
+    the response cache of this process, which changes whenever one of
+    them is written to
+"""
+def response_key(*tables):
+    return '{}-{}'.format(table_versions.tag(*tables), request.full_path)
+
+
+"""
+cached_response(response_cache, *tables)
+    serves a GET view built from the given tables from response_cache
+    until one of them is written to, gzip or brotli encoded when
+    the client accepts it, and answers 304 to clients that already
+    have the response. The ETag is the hash of the body, so every
+    worker gives the same content the same ETag. Responses read from
+    a replica are never cached.
+"""
+def cached_response(response_cache, *tables):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = response_key(*tables)
+            entry = response_cache.get(key)
+            if entry is None:
+                response = view(*args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                # A lagging replica may miss writes the table versions
+                # count, so only bodies read from the primary are shared
+                if served_by_replica():
+                    etag = body_etag(response.get_data())
+                    if request.if_none_match.contains_weak(etag):
+                        return not_modified(etag)
+                    return cacheable(response, etag)
+                entry = response_cache.put(key, tables, response.get_data())
+
+            if request.if_none_match.contains_weak(entry.etag):
+                return not_modified(entry.etag)
+            encoding = entry.encoding(request.accept_encodings)
+            response_cache.count_served(encoding)
+            # Encoded bodies are not byte for byte the same response
+            return cacheable(entry.response(encoding), entry.etag,
+                             weak=encoding != 'identity')
+        return wrapper
+    return decorator
+
+
+def not_modified(etag):
+    response = Response(status=304)
+    return cacheable(response, etag)
+
+
+def cacheable(response, etag, weak=False):
+    response.set_etag(etag, weak)
+    response.headers['Cache-Control'] = 'public, max-age={}, must-revalidate'.format(
+        CACHE_MAX_AGE)
+    return response
+
+
+"""
+quiz_category_id(quiz_category)
+    returns the category id of a quiz_category sent by the quiz view,
+    or None when the user plays every category
+"""
+def quiz_category_id(quiz_category):
+    # The quiz view sends the category index, ids start at 1
+    if quiz_category['type'] == 'click':
+        return None
+    return int(quiz_category['id']) + 1
+
+
+def cursor_limit():
+    limit = request.args.get('limit', QUESTIONS_PER_PAGE, type=int)
+    if limit < 1 or limit > MAX_QUESTIONS_PER_PAGE:
+        abort(400)
+    return limit
+
+
+"""
+check_cursor()
+    aborts with 400 when a cursor page asks for a bad limit. Views call
+    it before their try block, which turns every error into a 404.
+"""
+def check_cursor():
+    if request.args.get('after', type=int) is not None:
+        cursor_limit()
+
+
+"""
+paginate_ids(ids)
+    pages through a ranked list of question ids, by page or by
+    cursor like paginate_request (cursor pages are in id order),
+    and loads the questions of the page.
+    Returns the questions and the cursor of the next page.
+"""
+def paginate_ids(ids):
+    after = request.args.get('after', type=int)
+    next_cursor = None
+    if after is None:
+        page = request.args.get('page', 1, type=int)
+        if page < 1:
+            abort(404)
+        start = (page - 1) * QUESTIONS_PER_PAGE
+        page_ids = ids[start:start + QUESTIONS_PER_PAGE]
+        if not page_ids and page != 1:
+            abort(404)
+    else:
+        limit = cursor_limit()
+        page_ids = heapq.nsmallest(limit, (i for i in ids if i > after))
+        if len(page_ids) == limit:
+            next_cursor = page_ids[-1]
+
+    if not page_ids:
+        return [], next_cursor
+    questions = {question.id: question for question in
+                 question_query().filter(Question.id.in_(page_ids))}
+    items = [questions[i] for i in page_ids if i in questions]
+    return items, next_cursor
+
+
+"""
+paginate_snapshot(snapshot, ids)
+    pages through the sorted question ids of a snapshot, by page or by
+    cursor like paginate_request, and decodes the questions of the
+    page.
+    Returns the questions and the cursor of the next page.
+"""
+def paginate_snapshot(snapshot, ids):
+    after = request.args.get('after', type=int)
+    if after is None:
+        limit = QUESTIONS_PER_PAGE
+        page = request.args.get('page', 1, type=int)
+        if page < 1:
+            abort(404)
+        start = (page - 1) * limit
+        if start >= len(ids) and page != 1:
+            abort(404)
+    else:
+        limit = cursor_limit()
+        start = bisect.bisect_right(ids, after)
+
+    page_ids = ids[start:start + limit]
+    next_cursor = page_ids[-1] if len(page_ids) == limit else None
+    return snapshot.questions(page_ids), next_cursor
+
+
+"""
+register_error_handlers(app)
+    returns the errors of the app as JSON
+"""
+def register_error_handlers(app):
+    @app.errorhandler(404)
+    def not_found(error):
+        return json_response({
+            'success': False,
+            'message': ERROR_MESSAGES[404],
+            'error': 404
+        }, 404)
+
+    @app.errorhandler(422)
+    def unprocessable(error):
+        return json_response({
+            'success': False,
+            'message': ERROR_MESSAGES[422],
+            'error': 422
+        }, 422)
+
+    @app.errorhandler(400)
+    def bad_request(error):
+        return json_response({
+            'success': False,
+            'message': ERROR_MESSAGES[400],
+            'error': 400
+        }, 400)
+
+    @app.errorhandler(405)
+    def method_not_allowed(error):
+        return json_response({
+            'success': False,
+            'message': ERROR_MESSAGES[405],
+            'error': 405
+        }, 405)
+
+    @app.errorhandler(429)
+    @app.errorhandler(503)
+    def retry_later(error):
+        response = json_response({
+            'success': False,
+            'message': ERROR_MESSAGES[error.code],
+            'error': error.code
+        }, error.code)
+        response.headers['Retry-After'] = str(
+            math.ceil(g.get('retry_after', 1)))
+        return response
+
+
+"""
+warm_caches(boot_profile)
+    loads the categories, question counts, quiz index and search index
+    of the current app, so its first requests do not
+"""
+def warm_caches(boot_profile):
+    for step, warm in [('warm categories', category_cache.all),
+                       ('warm counts', question_counts.counts),
+                       ('warm quiz index', quiz_index.ids),
+                       ('warm search index', search_index.warm)]:
+        warm()
+        boot_profile.mark(step)
+
+
+"""
+create_snapshot_routes(app, snapshot, boot_profile)
+    serves the GET endpoints and the quiz of the app from a read-only
+    snapshot file instead of the database. The responses have the
+    same JSON as those of the database.
+"""
+def create_snapshot_routes(app, snapshot, boot_profile):
+    snapshot_quiz_index = SnapshotQuizIndex(snapshot)
+
+    def snapshot_etag():
+        # The snapshot never changes while it is served
+        return '{}-{}'.format(snapshot.digest, request.full_path)
+
+    @app.route('/categories')
+    def get_categories():
+        etag = snapshot_etag()
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        return cacheable(json_response({
+            'success': True,
+            'categories': snapshot.category_types(),
+        }), etag)
+
+    @app.route('/questions')
+    def get_questions():
+        check_cursor()
+        etag = snapshot_etag()
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        try:
+            questions, next_cursor = paginate_snapshot(
+                snapshot, snapshot.ids())
+            if not questions and 'after' not in request.args:
+                abort(404)
+        except Exception as e:
+            print(e)
+            abort(404)
+
+        return cacheable(json_response({
+            'success': True,
+            'questions': format_questions(questions),
+            'total_questions': snapshot.question_count,
+            'categories': snapshot.category_types(),
+            'current_category': request.args.get('category'),
+            'next_cursor': next_cursor
+        }), etag)
+
+    @app.route('/questions/export')
+    def export_all_questions():
+        if request.args.get('format') == 'csv':
+            return Response(export_rows(snapshot.rows(), True),
+                            mimetype='text/csv')
+        return Response(export_rows(snapshot.rows()),
+                        mimetype='application/x-ndjson')
+
+    @app.route('/categories/<int:category_id>/questions')
+    def get_questions_by_category(category_id):
+        check_cursor()
+        etag = snapshot_etag()
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        category_type = snapshot.category_type(category_id)
+        if category_type is None:
+            abort(404)
+        ids = snapshot.ids(category_id)
+        try:
+            questions, next_cursor = paginate_snapshot(snapshot, ids)
+        except Exception as e:
+            print(e)
+            abort(404)
+
+        return cacheable(json_response({
+            "success": True,
+            "questions": format_questions(questions),
+            "total_questions": len(ids),
+            "current_category": category_type,
+            "next_cursor": next_cursor
+        }), etag)
+
+    @app.route('/quizzes', methods=['POST'])
+    def play_quiz():
+        try:
+            body = request.get_json()
+            category_id = quiz_category_id(body.get('quiz_category'))
+            previous = set(body.get('previous_questions', None) or ())
+
+            difficulty = body.get('difficulty')
+            if difficulty is not None:
+                difficulty = target_difficulty(
+                    int(difficulty), body.get('correct'))
+
+            question_id = choose_question_id(
+                category_id, previous, difficulty, snapshot_quiz_index)
+            if question_id is None:
+                abort(404)
+
+            question = format_question(snapshot.question(question_id))
+            if difficulty is not None:
+                difficulty = question['difficulty']
+
+            return json_response({
+                'success': True,
+                'question': question,
+                'difficulty': difficulty
+            })
+        except Exception as e:
+            print(e)
+            abort(404)
+
+    @app.route('/quizzes/round', methods=['POST'])
+    def play_quiz_round():
+        # A missing or malformed body is a bad request, not a 500
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            abort(400)
+        count = body.get('count', QUIZ_ROUND_SIZE)
+        if (not isinstance(count, int) or isinstance(count, bool) or
+                count < 1 or count > MAX_QUIZ_ROUND_SIZE):
+            abort(400)
+        try:
+            category_id = quiz_category_id(body.get('quiz_category'))
+            previous = set(body.get('previous_questions', None) or ())
+
+            difficulty = body.get('difficulty')
+            if difficulty is not None:
+                difficulty = target_difficulty(int(difficulty), None)
+
+            question_ids = choose_question_ids(
+                category_id, previous, count, difficulty, snapshot_quiz_index)
+            if not question_ids:
+                abort(404)
+
+            questions = format_questions(snapshot.questions(question_ids))
+            if difficulty is not None and questions:
+                difficulty = questions[0]['difficulty']
+
+            return json_response({
+                'success': True,
+                'questions': questions,
+                'difficulty': difficulty
+            })
+        except Exception as e:
+            print(e)
+            abort(404)
+
+    @app.route('/metrics')
+    def get_metrics():
+        return json_response({
+            'success': True,
+            'snapshot': snapshot.status(),
+            'requests': request_profiler.snapshot(),
+            'boot': boot_profile.report()
+        })
+
+    register_error_handlers(app)
+    boot_profile.mark('routes')
+
+
+"""
+create_app(test_config, warm)
+    builds the app. With warm, or WARM_CACHES set, it loads the caches
+    and indexes before serving. The tables are created by
+    `flask init-db`.
+    With SNAPSHOT_PATH set, the app serves a snapshot file written by
+    `flask export-snapshot` and does not connect to the database.
+"""
+def create_app(test_config=None, warm=None):
+    boot_profile = BootProfile()
     # Create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    if test_config is not None:
+        app.config.update(test_config)
+    boot_profile.mark('config')
+    snapshot_path = app.config.get('SNAPSHOT_PATH', SNAPSHOT_PATH)
+    if not snapshot_path:
+        setup_db(app, app.config.get('SQLALCHEMY_DATABASE_URI', database_path),
+                 app.config.get('SQLALCHEMY_REPLICA_URLS', DB_REPLICA_URLS))
+        boot_profile.mark('setup_db')
 
     """
     Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -31,6 +495,68 @@ def create_app(test_config=None):
         )
         return response
 
+    # Opt-in request and query profiling
+    if app.config.get('PROFILING', PROFILING):
+        init_profiling(app)
+    elif app.config.get('SLOW_QUERY_MS', SLOW_QUERY_MS):
+        listen_queries()
+
+    if snapshot_path:
+        snapshot = Snapshot(snapshot_path)
+        boot_profile.mark('open snapshot')
+        create_snapshot_routes(app, snapshot, boot_profile)
+        boot_profile.log()
+        return app
+
+    # Clients read their own writes from the primary for a while
+    app.after_request(pin_writers)
+
+    # Bodies of the hot GET responses, with their gzip and brotli encodings
+    response_cache = ResponseCache(
+        app.config.get('RESPONSE_CACHE_BYTES', RESPONSE_CACHE_BYTES))
+
+    # Rate and concurrency limits of the endpoints that load the database
+    admission = AdmissionControl(
+        app.config.get('RATE_LIMIT_PER_MINUTE', RATE_LIMIT_PER_MINUTE),
+        app.config.get('RATE_LIMIT_BURST', RATE_LIMIT_BURST),
+        app.config.get('DB_CONCURRENCY_LIMIT', DB_CONCURRENCY_LIMIT))
+    # Also limits the async handlers of asgi.py
+    app.extensions['admission'] = admission
+
+    # Drop the caches of this worker when another one writes
+    # The engine is built on first use, after the app is configured
+    change_bus.start(app.config.get('CHANGE_BUS', CHANGE_BUS),
+                     lambda: db.get_engine(app))
+    # Started in each worker on its first request, after any fork
+    app.before_request(change_bus.ensure_started)
+
+    # Write the submitted scores in the background, tests roll them back
+    if not app.testing:
+        leaderboard.start(app)
+
+    """
+    Command to create the tables and indexes: flask init-db
+    """
+    @app.cli.command('init-db')
+    def init_db_command():
+        init_db()
+        if SEARCH_BACKEND == 'postgres':
+            search_index.create_index()
+        click.echo('Initialized the database.')
+
+    """
+    Command to write the questions and categories to a snapshot file
+    served with SNAPSHOT_PATH: flask export-snapshot trivia.snapshot
+    """
+    @app.cli.command('export-snapshot')
+    @click.argument('path')
+    def export_snapshot_command(path):
+        questions, categories = write_snapshot(path)
+        click.echo('Exported {} questions and {} categories to {}.'.format(
+            questions, categories, path))
+
+    boot_profile.mark('extensions')
+
 ###################################################################
 #  Categories
 ###################################################################
@@ -38,12 +564,13 @@ def create_app(test_config=None):
     Endpoint to handle GET requests for all available categories.
     """
     @app.route('/categories')
+    @cached_response(response_cache, 'categories')
+    @read_only
     def get_categories():
         try:
-            selection = Category.query.order_by(Category.id).all()
-            categories = [category.type for category in selection]
+            categories = category_cache.types()
 
-            return jsonify({
+            return json_response({
                 'success': True,
                 'categories': categories,
             })
@@ -69,13 +596,10 @@ def create_app(test_config=None):
             else:
                 abort(422)
 
-            # Select all questions
-            questions = Question.query.order_by(Question.id).all()
-
-            return jsonify({
+            return json_response({
                 'success': True,
                 'created': category.id,
-                'total_questions': len(questions)
+                'total_questions': question_counts.total()
             })
         except Exception as e:
             print(e)
@@ -92,33 +616,33 @@ def create_app(test_config=None):
     number of total questions, current category, categories.
     """
     @app.route('/questions')
+    @cached_response(response_cache, 'questions', 'categories')
+    @read_only
     def get_questions():
+        check_cursor()
         try:
             # Select all questions to paginate
-            page = request.args.get('page', 1, type=int)
-            selection = Question.query.order_by(
-                Question.id).paginate(
-                page=page, per_page=QUESTIONS_PER_PAGE).items
-            current_questions = [question.format()
-                                 for question in selection]
+            selection, next_cursor = paginate_request(
+                question_query().order_by(Question.id))
+            current_questions = format_questions(selection)
 
             # If there are no more questions return 404
-            if (len(current_questions) == 0):
+            if (len(current_questions) == 0 and 'after' not in request.args):
                 abort(404)
 
             # Get current category from args if exists
             current_category = request.args.get('category')
 
             # Select all categories and extract the type
-            c_selection = Category.query.order_by(Category.id).all()
-            categories = [category.type for category in c_selection]
+            categories = category_cache.types()
 
-            return jsonify({
+            return json_response({
                 'success': True,
                 'questions': current_questions,
-                'total_questions': len(Question.query.all()),
+                'total_questions': question_counts.total(),
                 'categories': categories,
-                'current_category': current_category
+                'current_category': current_category,
+                'next_cursor': next_cursor
             })
         except Exception as e:
             print(e)
@@ -142,20 +666,16 @@ def create_app(test_config=None):
 
             # Select all questions to paginate
             page = request.args.get('page', 1, type=int)
-            selection = Question.query.order_by(
-                Question.id).paginate(
-                page=page, per_page=QUESTIONS_PER_PAGE).items
-            current_questions = [question.format()
-                                 for question in selection]
+            selection = paginate(question_query().order_by(Question.id), page)
+            current_questions = format_questions(selection)
 
             # Select all categories and extract the type
-            c_selection = Category.query.order_by(Category.id).all()
-            categories = [category.type for category in c_selection]
+            categories = category_cache.types()
 
-            return jsonify({
+            return json_response({
                 'success': True,
                 'questions': current_questions,
-                'total_questions': len(Question.query.all()),
+                'total_questions': question_counts.total(),
                 'categories': categories,
                 'current_category': current_category
             })
@@ -187,48 +707,110 @@ def create_app(test_config=None):
             else:
                 abort(422)
 
-            # Select all questions
-            questions = Question.query.order_by(Question.id).all()
-
-            return jsonify({
+            return json_response({
                 'success': True,
                 'created': question.id,
-                'total_questions': len(questions)
+                'total_questions': question_counts.total()
             })
         except Exception as e:
             print(e)
             abort(405)
 
+    """
+    Endpoint to POST many questions at once as a streamed NDJSON body,
+    or CSV with a header row when the content type is text/csv.
+    Rows are validated one at a time and inserted in batches.
+    A body that is not valid UTF-8 or CSV returns 422 with the
+    statistics of the rows inserted before the error.
+    """
+    @app.route('/questions/bulk', methods=['POST'])
+    def bulk_create_questions():
+        batch_size = request.args.get('batch_size', BULK_BATCH_SIZE, type=int)
+        if batch_size < 1:
+            abort(400)
+        try:
+            category_ids = {id for id, type in category_cache.all()}
+            stats = import_questions(request.stream, request.content_type,
+                                     category_ids, batch_size)
+        except Exception as e:
+            print(e)
+            abort(422)
+
+        # A body that could not be read to the end is a partial import
+        return json_response(dict(stats, success=stats['completed'],
+                                  total_questions=question_counts.total()),
+                             200 if stats['completed'] else 422)
+
+    """
+    Endpoint to POST a batch of create, update and delete operations
+    on questions, applied in a single transaction.
+    Invalid operations are skipped and reported, or roll back the
+    whole batch when atomic is true.
+    """
+    @app.route('/questions/batch', methods=['POST'])
+    def batch_questions():
+        body = request.get_json()
+        operations = body.get('operations') if isinstance(body, dict) else None
+        if (not isinstance(operations, list) or
+                len(operations) > MAX_BATCH_OPERATIONS):
+            abort(400)
+        atomic = bool(body.get('atomic', False))
+        try:
+            category_ids = {id for id, type in category_cache.all()}
+            stats = apply_batch(operations, category_ids, atomic)
+        except Exception as e:
+            print(e)
+            abort(422)
+
+        success = not (atomic and stats['failed'])
+        return json_response(dict(stats, success=success,
+                                  total_questions=question_counts.total()),
+                             200 if success else 422)
+
+    """
+    Endpoint to GET every question as streamed NDJSON,
+    or CSV with ?format=csv.
+    """
+    @app.route('/questions/export')
+    @read_only
+    def export_all_questions():
+        if request.args.get('format') == 'csv':
+            return Response(stream_with_context(export_questions(True)),
+                            mimetype='text/csv')
+        return Response(stream_with_context(export_questions()),
+                        mimetype='application/x-ndjson')
+
     """
     POST endpoint to get questions based on a search term.
-    It should return any questions for whom the search term
-    is a substring of the question.
+    It should return any questions whose question or answer
+    contains every word of the search term, as a whole word or a
+    prefix, best matches first.
     """
     @app.route('/questions/search', methods=['POST'])
+    @admission.admit
+    @read_only
     def search_questions():
+        check_cursor()
         # Get search term
         body = request.get_json()
         search_term = body.get("searchTerm")
         try:
-            # Select all questions that includes the search term and paginate
+            # Find the questions that match the search term and paginate
             # them
-            page = request.args.get('page', 1, type=int)
-            selection = Question.query.order_by(Question.id).filter(
-                Question.question.ilike("%{}%".format(search_term))
-            ).paginate(page=page, per_page=QUESTIONS_PER_PAGE).items
-            current_questions = [question.format()
-                                 for question in selection]
+            ids = search_index.search(search_term)
+            selection, next_cursor = paginate_ids(ids)
+            current_questions = format_questions(selection)
 
             # Get current category from args if exists
             current_category = request.args.get('category')
 
-            return jsonify(
+            return json_response(
                 {
                     "success": True,
                     "questions": current_questions,
-                    "total_questions": len(Question.query.order_by(Question.id).filter(
-                Question.question.ilike("%{}%".format(search_term))).all()),
-                    "current_category": current_category
+                    "total_questions": len(ids),
+                    "current_category": current_category,
+                    "next_cursor": next_cursor
                 }
             )
         except Exception as e:
@@ -239,21 +821,28 @@ def create_app(test_config=None):
     GET endpoint to get questions based on category.
     """
     @app.route('/categories/<int:category_id>/questions')
+    @cached_response(response_cache, 'questions', 'categories')
+    @read_only
     def get_questions_by_category(category_id):
+        check_cursor()
         #Get the specific category
-        category = Category.query.filter_by(id=category_id).one_or_none()
+        category_type = category_cache.get(category_id)
         try:
+            if category_type is None:
+                abort(404)
+
             #Select all questions that belongs to the category and paginate
-            page = request.args.get('page', 1, type=int)
-            questions = Question.query.filter_by(category=str(category.id)).paginate(page=page, per_page=QUESTIONS_PER_PAGE).items
-            current_questions = [question.format()
-                                    for question in questions]
+            questions, next_cursor = paginate_request(
+                question_query().filter_by(category=category_id).order_by(
+                    Question.id))
+            current_questions = format_questions(questions)
 
-            return jsonify({
+            return json_response({
                 "success": True,
                 "questions": current_questions,
-                "total_questions": len( Question.query.filter_by(category=str(category.id)).all()),
-                "current_category": category.type
+                "total_questions": question_counts.category(category_id),
+                "current_category": category_type,
+                "next_cursor": next_cursor
             })
 
         except Exception as e:
@@ -268,71 +857,252 @@ def create_app(test_config=None):
     This endpoint should take category and previous question parameters
     and return a random questions within the given category,
     if provided, and that is not one of the previous questions.
+    In adaptive mode the body also holds the current difficulty and
+    whether the last answer was correct, and the question is drawn
+    from the next difficulty.
     """
     @app.route('/quizzes', methods=['POST'])
+    @admission.admit
+    @read_only
     def play_quiz():
         try:
-            # Get all quiz info and add 1 to category id
+            # Get all quiz info
             body = request.get_json()
-            quiz_category = body.get('quiz_category')
+            category_id = quiz_category_id(body.get('quiz_category'))
             previous_questions = body.get('previous_questions', None)
-            category_id = int(quiz_category['id']) + 1
 
-            # If user selects all
-            if(quiz_category['type'] == 'click'):
-                questions = Question.query.filter(
-                    Question.id.notin_(previous_questions)).all()
+            # In adaptive mode, move the difficulty after each answer
+            difficulty = body.get('difficulty')
+            if difficulty is not None:
+                difficulty = target_difficulty(
+                    int(difficulty), body.get('correct'))
 
-            else:
-                questions = Question.query.filter_by(
-                    category=str(category_id)).filter(
-                    Question.id.notin_(previous_questions)).all()
-
-            # Select a random question from the questions list
-            index = random.randint(0, len(questions) - 1)
-            random_question = questions[index]
-            print(random_question.format())
-            return jsonify({
+            # Select a random question that was not played yet
+            random_question = next_question(
+                category_id, previous_questions, difficulty)
+            if random_question is None:
+                abort(404)
+
+            # Report the level served, the target may have run out
+            question = format_question(random_question)
+            if difficulty is not None:
+                difficulty = question['difficulty']
+
+            return json_response({
                 'success': True,
-                'question': random_question.format()
+                'question': question,
+                'difficulty': difficulty
             })
         except Exception as e:
             print(e)
             abort(404)
 
     """
-    Error handlers
+    POST endpoint to get every question of a quiz round at once.
+    It takes the same parameters as /quizzes and the number of
+    questions to play, and returns that many distinct random
+    questions, or fewer when the category runs out of questions.
     """
-    @app.errorhandler(404)
-    def not_found(error):
-        return jsonify({
-            'success': False,
-            'message': 'resource not found',
-            'error': 404
-        }), 404
+    @app.route('/quizzes/round', methods=['POST'])
+    @admission.admit
+    @read_only
+    def play_quiz_round():
+        # A missing or malformed body is a bad request, not a 500
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            abort(400)
+        count = body.get('count', QUIZ_ROUND_SIZE)
+        if (not isinstance(count, int) or isinstance(count, bool) or
+                count < 1 or count > MAX_QUIZ_ROUND_SIZE):
+            abort(400)
+        try:
+            category_id = quiz_category_id(body.get('quiz_category'))
+            previous_questions = body.get('previous_questions', None)
 
-    @app.errorhandler(422)
-    def unprocessable(error):
-        return jsonify({
-            'success': False,
-            'message': 'resource unprocessable',
-            'error': 422
-        }), 422
+            difficulty = body.get('difficulty')
+            if difficulty is not None:
+                difficulty = target_difficulty(int(difficulty), None)
 
-    @app.errorhandler(400)
-    def bad_request(error):
-        return jsonify({
-            'success': False,
-            'message': 'Bad request',
-            'error': 400
-        }), 400
+            # Draw the questions of the round and load them together
+            questions = next_round(category_id, previous_questions, count,
+                                   difficulty)
+            if not questions:
+                abort(404)
 
-    @app.errorhandler(405)
-    def method_not_allowed(error):
-        return jsonify({
-            'success': False,
-            'message': 'method not allowed',
-            'error': 405
-        }), 405
+            # The first question is drawn from the closest level served
+            questions = format_questions(questions)
+            if difficulty is not None:
+                difficulty = questions[0]['difficulty']
+
+            return json_response({
+                'success': True,
+                'questions': questions,
+                'difficulty': difficulty
+            })
+        except Exception as e:
+            print(e)
+            abort(404)
+
+###################################################################
+#  Leaderboard
+###################################################################
+    """
+    POST endpoint to submit the score of a finished quiz.
+    It takes the player name, the quiz category as sent to /quizzes
+    and the number of correct answers, and returns the player's
+    points and rank over every quiz.
+    """
+    @app.route('/scores', methods=['POST'])
+    def submit_score():
+        try:
+            body = request.get_json()
+            player = (body.get('player') or '').strip()
+            correct = body.get('correct')
+            if (not player or len(player) > MAX_PLAYER_LENGTH or
+                    not isinstance(correct, int) or
+                    isinstance(correct, bool) or
+                    not 0 <= correct <= MAX_QUIZ_ROUND_SIZE):
+                abort(422)
+            category_id = quiz_category_id(body.get('quiz_category'))
+            if (category_id is not None and
+                    category_cache.get(category_id) is None):
+                abort(422)
+
+            points, rank = leaderboard.submit(player, category_id, correct)
+
+            return json_response({
+                'success': True,
+                'player': player,
+                'points': points,
+                'rank': rank
+            })
+        except Exception as e:
+            print(e)
+            abort(422)
+
+    def leaderboard_response(category_id):
+        count = request.args.get('limit', LEADERBOARD_SIZE, type=int)
+        if count < 1 or count > MAX_LEADERBOARD_SIZE:
+            abort(400)
+        try:
+            ranking, players = leaderboard.top(category_id, count)
+        except Exception as e:
+            print(e)
+            abort(404)
+
+        return json_response({
+            'success': True,
+            'leaderboard': [{'rank': rank, 'player': player, 'points': points}
+                            for rank, player, points in ranking],
+            'total_players': players
+        })
+
+    """
+    GET endpoint to get the best players over every quiz.
+    """
+    @app.route('/leaderboard')
+    @read_only
+    def get_leaderboard():
+        return leaderboard_response(None)
+
+    """
+    GET endpoint to get the best players of a category.
+    """
+    @app.route('/categories/<int:category_id>/leaderboard')
+    @read_only
+    def get_category_leaderboard(category_id):
+        if category_cache.get(category_id) is None:
+            abort(404)
+        return leaderboard_response(category_id)
+
+###################################################################
+#  Metrics
+###################################################################
+    """
+    GET endpoint to get the metrics of this process,
+    such as the state of the database connection pool
+    and the request profiles when profiling is enabled.
+    """
+    @app.route('/metrics')
+    def get_metrics():
+        return json_response({
+            'success': True,
+            'pool': pool_status(db.engine),
+            'replicas': replica_set.status(),
+            'admission': admission.status(),
+            'response_cache': response_cache.status(),
+            'change_bus': change_bus.status(),
+            'requests': request_profiler.snapshot(),
+            'boot': boot_profile.report()
+        })
+
+    """
+    POST endpoint to start a quiz session for a category.
+    The questions of the category are shuffled once and kept on the
+    server, so the client only has to ask for the next one.
+    """
+    @app.route('/quizzes/sessions', methods=['POST'])
+    @admission.admit
+    def create_quiz_session():
+        try:
+            body = request.get_json()
+            category_id = quiz_category_id(body.get('quiz_category'))
+            question_ids = quiz_index.ids(category_id)
+            if not question_ids:
+                abort(404)
+
+            session_id = session_store.create(question_ids)
+
+            return json_response({
+                'success': True,
+                'session_id': session_id,
+                'total_questions': len(question_ids)
+            })
+        except Exception as e:
+            print(e)
+            abort(404)
+
+    """
+    GET endpoint to get the next question of a quiz session.
+    The question is null once every question was played.
+    """
+    @app.route('/quizzes/sessions/<session_id>/next')
+    def next_session_question(session_id):
+        try:
+            while True:
+                question_id, remaining = session_store.pop(session_id)
+                if question_id is None:
+                    question = None
+                    break
+                # Skip the questions deleted since the session started
+                question = question_query().filter(
+                    Question.id == question_id).first()
+                if question is not None:
+                    break
+
+            return json_response({
+                'success': True,
+                'question': format_question(question) if question else None,
+                'remaining': remaining
+            })
+        except Exception as e:
+            print(e)
+            abort(404)
+
+    register_error_handlers(app)
+
+    boot_profile.mark('routes')
+
+    if warm is None:
+        warm = app.config.get('WARM_CACHES', WARM_CACHES)
+    if warm:
+        with app.app_context():
+            try:
+                warm_caches(boot_profile)
+            except Exception as e:
+                print(e)
+            finally:
+                db.session.remove()
+    boot_profile.log()
 
     return app
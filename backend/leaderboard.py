@@ -0,0 +1,306 @@
+import atexit
+import os
+import random
+import threading
+import time
+
+from sqlalchemy import text
+
+from models import db, Score
+from replicas import primary
+from bus import change_bus
+from settings import SCORE_FLUSH_INTERVAL
+
+# Players returned by a leaderboard request
+LEADERBOARD_SIZE = 10
+MAX_LEADERBOARD_SIZE = 100
+
+# Longest player name, as stored in the scores table
+MAX_PLAYER_LENGTH = 80
+
+# Levels of the skip lists, enough for about 4**16 players
+MAX_LEVEL = 16
+
+# Adds the points and games of a flush to the stored ones, Postgres and
+# SQLite both support ON CONFLICT
+UPSERT_SCORES = text(
+    'INSERT INTO scores (player, category, points, games) '
+    'VALUES (:player, :category, :points, :games) '
+    'ON CONFLICT (player, category) DO UPDATE SET '
+    'points = scores.points + excluded.points, '
+    'games = scores.games + excluded.games')
+
+
+class SkipNode:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        # Number of nodes from this node to the next one on each level
+        self.width = [1] * level
+
+
+"""
+RankedList
+    indexable skip list of keys in ascending order. Inserting or
+    removing a key and finding its rank take O(log n) on average, and
+    the first k keys are read in O(k).
+"""
+class RankedList:
+
+    def __init__(self):
+        self.head = SkipNode(None, MAX_LEVEL)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def path(self, key):
+        """
+        Returns the last node before key on every level and the rank of
+        each of those nodes, the head having rank 0.
+        """
+        chain = [None] * MAX_LEVEL
+        ranks = [0] * MAX_LEVEL
+        node = self.head
+        rank = 0
+        for level in reversed(range(MAX_LEVEL)):
+            while (node.next[level] is not None
+                   and node.next[level].key < key):
+                rank += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            ranks[level] = rank
+        return chain, ranks
+
+    def insert(self, key):
+        chain, ranks = self.path(key)
+        level = 1
+        while level < MAX_LEVEL and random.random() < 0.25:
+            level += 1
+        node = SkipNode(key, level)
+        position = ranks[0] + 1
+        for i in range(level):
+            before = chain[i]
+            node.next[i] = before.next[i]
+            node.width[i] = before.width[i] - (position - ranks[i]) + 1
+            before.next[i] = node
+            before.width[i] = position - ranks[i]
+        for i in range(level, MAX_LEVEL):
+            chain[i].width[i] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain, ranks = self.path(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for i in range(MAX_LEVEL):
+            before = chain[i]
+            if before.next[i] is node:
+                before.width[i] += node.width[i] - 1
+                before.next[i] = node.next[i]
+            else:
+                before.width[i] -= 1
+        self.size -= 1
+
+    def rank(self, key):
+        """Returns the index of key, or raises KeyError."""
+        chain, ranks = self.path(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        return ranks[0]
+
+    def first(self, count):
+        keys = []
+        node = self.head.next[0]
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+"""
+Leaderboard
+    ranks the players by points, over every quiz and per category,
+    in skip lists kept in memory. Scores are added to the ranking as
+    they are submitted and written to the scores table in batches by
+    a background thread every SCORE_FLUSH_INTERVAL seconds. A flush is
+    sent on the change bus, and the other workers reload the ranking
+    from the table on their next request, along with the scores they
+    have not written yet. A forked worker starts its own thread on
+    its first score.
+"""
+class Leaderboard:
+
+    def __init__(self):
+        # App and interval given to start, the flusher is started in
+        # each process on first use
+        self.app = None
+        self.interval = SCORE_FLUSH_INTERVAL
+        self.pid = None
+        self.reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        """
+        Drops the state of the parent in a forked worker: its flusher
+        thread did not survive the fork and its pending scores are
+        written by the parent.
+        """
+        self.lock = threading.Lock()
+        # Ranked (-points, player) keys per category, None for every quiz
+        self.boards = None
+        self.points = {}
+        # Points and games to add per (player, category) on next flush
+        self.pending = {}
+        # Those of the flush being written, and the number of loads
+        self.flushing = {}
+        self.loads = 0
+        self.flusher = None
+
+    def load(self):
+        self.boards = {None: RankedList()}
+        self.points = {}
+        with primary():
+            rows = db.session.query(
+                Score.player, Score.category, Score.points).all()
+        for player, category, points in rows:
+            self.add(None, player, points)
+            if category:
+                self.add(category, player, points)
+        # Scores of this worker not in the table yet
+        for scores in (self.flushing, self.pending):
+            for (player, category), (points, games) in scores.items():
+                self.add(None, player, points)
+                if category:
+                    self.add(category, player, points)
+        self.loads += 1
+
+    def add(self, category, player, points):
+        board = self.boards.setdefault(category, RankedList())
+        key = (category, player)
+        total = self.points.get(key)
+        if total is not None:
+            board.remove((-total, player))
+        total = (total or 0) + points
+        self.points[key] = total
+        board.insert((-total, player))
+
+    def submit(self, player, category, points):
+        """
+        Adds the points of a quiz played on a category, None for every
+        category, and returns the player's total points and rank over
+        every quiz, the best player having rank 1.
+        """
+        self.ensure_started()
+        with self.lock:
+            if self.boards is None:
+                self.load()
+            self.add(None, player, points)
+            if category is not None:
+                self.add(category, player, points)
+            delta = self.pending.setdefault((player, category or 0), [0, 0])
+            delta[0] += points
+            delta[1] += 1
+
+            total = self.points[(None, player)]
+            return total, self.boards[None].rank((-total, player)) + 1
+
+    def top(self, category=None, count=LEADERBOARD_SIZE):
+        """
+        Returns the best players of a category, None for every quiz, as
+        (rank, player, points) tuples, and the number of ranked players.
+        """
+        with self.lock:
+            if self.boards is None:
+                self.load()
+            board = self.boards.get(category)
+            if board is None:
+                return [], 0
+            keys = board.first(count)
+            players = len(board)
+        return [(rank, player, -points) for rank, (points, player)
+                in enumerate(keys, 1)], players
+
+    def invalidate(self):
+        with self.lock:
+            self.boards = None
+
+    def flush(self):
+        """
+        Writes the pending scores in one transaction and returns their
+        number. They are kept for the next flush if the write fails.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.flushing = pending
+            loads = self.loads
+        if not pending:
+            return 0
+        try:
+            db.session.execute(UPSERT_SCORES, [
+                {'player': player, 'category': category, 'points': points,
+                 'games': games}
+                for (player, category), (points, games) in pending.items()])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self.lock:
+                self.flushing = {}
+                for key, (points, games) in pending.items():
+                    delta = self.pending.setdefault(key, [0, 0])
+                    delta[0] += points
+                    delta[1] += games
+            raise
+        with self.lock:
+            self.flushing = {}
+            # A load during the write may have counted them twice
+            if self.loads != loads:
+                self.boards = None
+        change_bus.publish('scores', None, 'bulk')
+        return len(pending)
+
+    def flush_app(self):
+        with self.app.app_context():
+            try:
+                self.flush()
+            except Exception as e:
+                print(e)
+            finally:
+                db.session.remove()
+
+    def run(self, interval):
+        while True:
+            time.sleep(interval)
+            self.flush_app()
+
+    def start(self, app, interval=SCORE_FLUSH_INTERVAL):
+        """
+        Flushes the scores of app in the background, and on exit. The
+        thread is started by the first score of the process, see
+        ensure_started. Later calls only switch to the new app.
+        """
+        self.app = app
+        self.interval = interval
+
+    def ensure_started(self):
+        """Starts the flusher of this process, if not already."""
+        if self.app is None or self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.flusher = threading.Thread(
+                target=self.run, args=(self.interval,), daemon=True)
+            self.flusher.start()
+            atexit.register(self.flush_app)
+            self.pid = os.getpid()
+
+
+leaderboard = Leaderboard()
+# Scores written by the other workers
+change_bus.subscribe('scores', leaderboard.invalidate)
@@ -0,0 +1,37 @@
+--
+-- Makes questions.category an integer foreign key to categories.id and
+-- adds the indexes used by the category listing and the quizzes.
+-- Databases loaded from trivia.psql already have the integer column and
+-- the foreign key; tables created by an older db.create_all() have a
+-- varchar column. The migration can be run on both, more than once:
+--
+--     psql trivia < migrations/001_question_category_fk.sql
+--
+
+BEGIN;
+
+ALTER TABLE questions
+    ALTER COLUMN category TYPE integer USING category::integer;
+
+UPDATE questions SET category = NULL
+    WHERE category NOT IN (SELECT id FROM categories);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'questions'::regclass AND contype = 'f'
+    ) THEN
+        ALTER TABLE questions
+            ADD CONSTRAINT category FOREIGN KEY (category)
+            REFERENCES categories(id) ON UPDATE CASCADE ON DELETE SET NULL;
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS questions_category_id_idx
+    ON questions (category, id);
+
+CREATE INDEX IF NOT EXISTS questions_difficulty_idx
+    ON questions (difficulty);
+
+COMMIT;
@@ -0,0 +1,16 @@
+--
+-- Adds the scores table written by the leaderboard, as `flask init-db`
+-- does; this file is for databases managed by hand. It can be run more
+-- than once:
+--
+--     psql trivia < migrations/002_scores.sql
+--
+
+CREATE TABLE IF NOT EXISTS scores (
+    id serial PRIMARY KEY,
+    player varchar(80) NOT NULL,
+    category integer NOT NULL DEFAULT 0,
+    points integer NOT NULL DEFAULT 0,
+    games integer NOT NULL DEFAULT 0,
+    CONSTRAINT scores_player_category_key UNIQUE (player, category)
+);
@@ -0,0 +1,12 @@
+--
+-- Adds the GIN index used by the Postgres search backend
+-- (SEARCH_BACKEND=postgres), as `flask init-db` does. It can be run
+-- more than once:
+--
+--     psql trivia < migrations/003_search_index.sql
+--
+
+CREATE INDEX IF NOT EXISTS questions_search_idx
+    ON questions USING GIN ((
+        setweight(to_tsvector('english', coalesce(question, '')), 'A')
+        || setweight(to_tsvector('english', coalesce(answer, '')), 'B')));
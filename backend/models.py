@@ -1,24 +1,140 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+import sqlite3
+from sqlalchemy import (Column, String, Integer, ForeignKey, Index,
+                        UniqueConstraint, create_engine, event)
+from sqlalchemy.engine import Engine
 from flask_sqlalchemy import SQLAlchemy
 import json
-from settings import DB_NAME, DB_USER, DB_HOST
+from settings import (DB_NAME, DB_USER, DB_HOST, DB_POOL_PROFILE,
+                      DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+                      DB_POOL_RECYCLE, DB_STATEMENT_TIMEOUT, DB_REPLICA_URLS)
+from pool import engine_options
+from replicas import RoutingSQLAlchemy, replica_set
+from bus import change_bus
 
 database_path = 'postgresql://{}@{}/{}'.format(DB_USER, DB_HOST, DB_NAME)
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
+
+# Callbacks run after a question write has been committed
+question_listeners = []
+
+"""
+on_question_change(callback)
+    registers callback(op, question) to be run after a question
+    is inserted, updated or deleted. op is 'bulk' and question None
+    when many rows were written at once and derived data must be
+    reloaded.
+"""
+def on_question_change(callback):
+    question_listeners.append(callback)
+    return callback
+
+
+def apply_question_change(op, question):
+    for callback in question_listeners:
+        callback(op, question)
+
+
+"""
+notify_question_change(op, question)
+    runs the question listeners of this worker and sends the change to
+    the other workers, which reload what they derived from the table
+"""
+def notify_question_change(op, question):
+    apply_question_change(op, question)
+    change_bus.publish(
+        'questions', question.id if question is not None else None, op)
+
+
+# Callbacks run after a category write has been committed
+category_listeners = []
+
+"""
+on_category_change(callback)
+    registers callback(op, category) to be run after a category
+    is inserted
+"""
+def on_category_change(callback):
+    category_listeners.append(callback)
+    return callback
+
+
+def apply_category_change(op, category):
+    for callback in category_listeners:
+        callback(op, category)
+
+
+def notify_category_change(op, category):
+    apply_category_change(op, category)
+    change_bus.publish(
+        'categories', category.id if category is not None else None, op)
+
+
+# Writes of the other workers reload the derived data of their table
+change_bus.subscribe('questions', lambda: apply_question_change('bulk', None))
+change_bus.subscribe('categories', lambda: apply_category_change('bulk', None))
+
+def sqlite_connect(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        # Let SQLAlchemy begin transactions instead of the driver
+        dbapi_connection.isolation_level = None
+
+
+def sqlite_begin(connection):
+    if connection.dialect.name == 'sqlite':
+        connection.execute('BEGIN')
+
+
+"""
+sqlite_transactions()
+    makes SQLite transactions begin when SQLAlchemy begins them, as the
+    sqlite3 driver otherwise commits on the release of a savepoint
+    opened outside a transaction
+"""
+def sqlite_transactions():
+    if not event.contains(Engine, 'connect', sqlite_connect):
+        event.listen(Engine, 'connect', sqlite_connect)
+        event.listen(Engine, 'begin', sqlite_begin)
+
+
+def pool_options(database_path):
+    """Returns the engine options of a database URL."""
+    if database_path.startswith('postgres'):
+        return engine_options(DB_POOL_PROFILE, {
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'pool_timeout': DB_POOL_TIMEOUT,
+            'pool_recycle': DB_POOL_RECYCLE,
+            'statement_timeout': DB_STATEMENT_TIMEOUT,
+        })
+    if database_path.startswith('sqlite'):
+        sqlite_transactions()
+    return {}
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service.
+    Postgres connections are pooled with the DB_POOL_PROFILE profile.
+    The read-only views read from the replica_urls databases when
+    given. The tables are created by init_db, not here.
 """
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, replica_urls=DB_REPLICA_URLS):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = pool_options(database_path)
+    replica_set.configure(replica_urls, pool_options)
     db.app = app
     db.init_app(app)
-    with app.app_context():
-        db.create_all()
+
+
+"""
+init_db()
+    creates the tables and indexes that do not exist yet in the
+    database of the current app, as `flask init-db` does
+"""
+def init_db():
+    db.create_all()
 
 """
 Question
@@ -26,11 +142,17 @@ Question
 """
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        Index('questions_category_id_idx', 'category', 'id'),
+        Index('questions_difficulty_idx', 'difficulty'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey(
+        'categories.id', name='category', onupdate='CASCADE',
+        ondelete='SET NULL'))
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -42,13 +164,16 @@ class Question(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        notify_question_change('insert', self)
 
     def update(self):
         db.session.commit()
+        notify_question_change('update', self)
 
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        notify_question_change('delete', self)
 
     def format(self):
         return {
@@ -72,8 +197,40 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+        notify_category_change('insert', self)
+
     def format(self):
         return {
             'id': self.id,
             'type': self.type
             }
+
+"""
+Score
+    points won by a player in the quizzes of a category, category 0
+    holding those of the quizzes played on every category
+
+"""
+class Score(db.Model):
+    __tablename__ = 'scores'
+    __table_args__ = (
+        UniqueConstraint('player', 'category',
+                         name='scores_player_category_key'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    player = Column(String(80), nullable=False)
+    category = Column(Integer, nullable=False, default=0)
+    points = Column(Integer, nullable=False, default=0)
+    games = Column(Integer, nullable=False, default=0)
+
+    def format(self):
+        return {
+            'player': self.player,
+            'category': self.category,
+            'points': self.points,
+            'games': self.games
+            }
@@ -0,0 +1,134 @@
+import threading
+import time
+
+from sqlalchemy.pool import QueuePool
+
+# Upper bounds in seconds of the checkout latency histogram buckets
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5]
+
+"""
+Pooling profiles, picked with DB_POOL_PROFILE. web suits a gunicorn
+worker serving requests, worker a background job with few connections.
+"""
+POOL_PROFILES = {
+    'default': {
+        'pool_size': 5,
+        'max_overflow': 10,
+        'pool_timeout': 30,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+        'statement_timeout': 30000,
+    },
+    'web': {
+        'pool_size': 10,
+        'max_overflow': 5,
+        'pool_timeout': 5,
+        'pool_recycle': 600,
+        'pool_pre_ping': True,
+        'statement_timeout': 5000,
+    },
+    'worker': {
+        'pool_size': 2,
+        'max_overflow': 0,
+        'pool_timeout': 60,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+        'statement_timeout': 0,
+    },
+}
+
+"""
+PoolStats
+    collects how long connection checkouts take, including the time
+    spent waiting for a free connection
+"""
+class PoolStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.wait_seconds = 0.0
+            self.max_wait_seconds = 0.0
+            self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, seconds, timed_out=False):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    break
+            else:
+                index = len(LATENCY_BUCKETS)
+            self.buckets[index] += 1
+
+    def snapshot(self):
+        with self.lock:
+            bounds = [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf']
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': round(self.wait_seconds, 6),
+                'wait_seconds_max': round(self.max_wait_seconds, 6),
+                'checkout_latency_histogram': dict(zip(bounds, self.buckets)),
+            }
+
+
+pool_stats = PoolStats()
+
+"""
+InstrumentedQueuePool
+    QueuePool that records the latency of every connection checkout
+"""
+class InstrumentedQueuePool(QueuePool):
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            pool_stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_stats.record(time.perf_counter() - start)
+        return connection
+
+
+def engine_options(profile, overrides=None):
+    """
+    Returns the SQLALCHEMY_ENGINE_OPTIONS of a pooling profile, with
+    the values set in overrides replacing the profile's.
+    """
+    options = dict(POOL_PROFILES[profile])
+    options.update({key: value for key, value in (overrides or {}).items()
+                    if value is not None})
+    statement_timeout = options.pop('statement_timeout')
+    options['poolclass'] = InstrumentedQueuePool
+    if statement_timeout:
+        options['connect_args'] = {
+            'options': '-c statement_timeout={}'.format(statement_timeout)}
+    return options
+
+
+def pool_status(engine):
+    """Returns the current state of an engine's pool with its stats."""
+    pool = engine.pool
+    status = {'class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+            'timeout': pool.timeout(),
+        })
+    status.update(pool_stats.snapshot())
+    return status
@@ -0,0 +1,204 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from flask import (current_app, g, request, has_app_context,
+                   has_request_context)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from settings import SLOW_QUERY_MS
+
+logger = logging.getLogger(__name__)
+
+# Requests kept per endpoint to compute the percentiles
+WINDOW_SIZE = 1000
+PERCENTILES = [50, 95, 99]
+
+
+def percentile(values, rank):
+    """Returns the nearest-rank percentile of sorted values."""
+    if not values:
+        return 0
+    index = max(0, -(-rank * len(values) // 100) - 1)
+    return values[index]
+
+
+"""
+RequestProfiler
+    keeps the recent request profiles of every endpoint: total time,
+    database time, number of queries, rows fetched and time spent
+    serializing JSON
+"""
+class RequestProfiler:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.counts = {}
+
+    def record(self, endpoint, profile):
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+            self.samples.setdefault(
+                endpoint, deque(maxlen=WINDOW_SIZE)).append(profile)
+
+    def snapshot(self):
+        with self.lock:
+            samples = {endpoint: list(profiles)
+                       for endpoint, profiles in self.samples.items()}
+            counts = dict(self.counts)
+
+        stats = {}
+        for endpoint, profiles in samples.items():
+            stats[endpoint] = {'requests': counts[endpoint]}
+            for key in ['total_ms', 'db_ms', 'serialize_ms', 'queries',
+                        'rows']:
+                values = sorted(profile[key] for profile in profiles)
+                stats[endpoint][key] = {
+                    'p{}'.format(rank): round(percentile(values, rank), 3)
+                    for rank in PERCENTILES}
+        return stats
+
+    def reset(self):
+        with self.lock:
+            self.samples = {}
+            self.counts = {}
+
+
+request_profiler = RequestProfiler()
+
+
+"""
+BootProfile
+    times the steps of building an app, to report where its startup
+    time goes
+"""
+class BootProfile:
+
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+        self.steps = OrderedDict()
+
+    def mark(self, step):
+        """Records the time since the previous step as step."""
+        now = time.perf_counter()
+        self.steps[step] = (now - self.last) * 1000
+        self.last = now
+
+    def report(self):
+        return {
+            'steps': [{'step': step, 'ms': round(ms, 3)}
+                      for step, ms in self.steps.items()],
+            'total_ms': round((self.last - self.start) * 1000, 3)
+        }
+
+    def log(self):
+        logger.info('App built in %.1f ms: %s', (self.last - self.start) * 1000,
+                    ', '.join('{} {:.1f} ms'.format(step, ms)
+                              for step, ms in self.steps.items()))
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+    if context is not None:
+        context.query_started = True
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    seconds = time.perf_counter() - conn.info['query_start'].pop()
+    if has_request_context() and 'profile' in g:
+        g.profile['queries'] += 1
+        g.profile['db_seconds'] += seconds
+        # The driver reports the rows of buffered results, -1 otherwise
+        if cursor.rowcount > 0:
+            g.profile['rows'] += cursor.rowcount
+    slow_query_ms = (current_app.config.get('SLOW_QUERY_MS', SLOW_QUERY_MS)
+                     if has_app_context() else SLOW_QUERY_MS)
+    if slow_query_ms and seconds * 1000 >= slow_query_ms:
+        logger.warning('Slow query (%.1f ms): %s', seconds * 1000, statement)
+
+
+def handle_error(context):
+    # after_cursor_execute is not called for a failed statement, its
+    # start would stay on the pooled connection
+    started = (context.execution_context is None or
+               getattr(context.execution_context, 'query_started', False))
+    if context.connection is not None and started:
+        starts = context.connection.info.get('query_start')
+        if starts:
+            starts.pop()
+
+
+def timed_encoder(base):
+    """Returns a JSON encoder class that adds its time to the profile."""
+    class TimedJSONEncoder(base):
+
+        def encode(self, o):
+            start = time.perf_counter()
+            try:
+                return super().encode(o)
+            finally:
+                if has_request_context() and 'profile' in g:
+                    g.profile['serialize_seconds'] += (
+                        time.perf_counter() - start)
+
+    return TimedJSONEncoder
+
+
+"""
+listen_queries()
+    times every query run by any engine, to profile requests and
+    log the queries slower than SLOW_QUERY_MS
+"""
+def listen_queries():
+    if not event.contains(Engine, 'before_cursor_execute',
+                          before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+        event.listen(Engine, 'handle_error', handle_error)
+
+
+"""
+init_profiling(app)
+    profiles every request of the app. Adds a Server-Timing header to
+    the responses and keeps per-endpoint stats in request_profiler.
+"""
+def init_profiling(app):
+    listen_queries()
+    app.json_encoder = timed_encoder(app.json_encoder)
+
+    @app.before_request
+    def start_profile():
+        g.profile = {
+            'start': time.perf_counter(),
+            'queries': 0,
+            'rows': 0,
+            'db_seconds': 0.0,
+            'serialize_seconds': 0.0,
+        }
+
+    @app.after_request
+    def end_profile(response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        total_ms = (time.perf_counter() - profile['start']) * 1000
+        db_ms = profile['db_seconds'] * 1000
+        serialize_ms = profile['serialize_seconds'] * 1000
+        response.headers.add('Server-Timing', (
+            'db;dur={:.3f};desc="{} queries, {} rows", '
+            'serialize;dur={:.3f}, total;dur={:.3f}').format(
+            db_ms, profile['queries'], profile['rows'], serialize_ms,
+            total_ms))
+        request_profiler.record(request.endpoint or request.path, {
+            'total_ms': total_ms,
+            'db_ms': db_ms,
+            'serialize_ms': serialize_ms,
+            'queries': profile['queries'],
+            'rows': profile['rows'],
+        })
+        return response
@@ -0,0 +1,246 @@
+import random
+import threading
+from array import array
+
+from models import db, Question, on_question_change
+from serialize import question_query
+from replicas import primary
+
+# Random draws to try before falling back to scanning the candidates
+MAX_REJECTIONS = 32
+
+# Range of question difficulties
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+
+"""
+QuizIndex
+    keeps the question ids of every category, and of every category
+    and difficulty, in compact integer arrays, so a quiz question can
+    be drawn without loading the candidates from the database. The
+    index is built once with a single query and kept in sync by the
+    question write hooks. Questions are drawn while holding the lock,
+    as a delete swaps and pops ids of the arrays in place.
+"""
+class QuizIndex:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = None
+
+    def load(self):
+        self.buckets = {}
+        with primary():
+            rows = db.session.query(
+                Question.id, Question.category, Question.difficulty).order_by(
+                Question.id).all()
+        for question_id, category, difficulty in rows:
+            self.add(question_id, category, difficulty)
+
+    def keys(self, category, difficulty):
+        """
+        Returns the buckets a question belongs to: all questions, its
+        category, its difficulty and its category and difficulty. A
+        question without a difficulty is only in the first two.
+        """
+        category = str(category)
+        if difficulty is None:
+            return [(None, None), (category, None)]
+        return [(None, None), (category, None), (None, difficulty),
+                (category, difficulty)]
+
+    def bucket(self, category, difficulty):
+        """
+        Returns the live ids of a bucket, which the writers change in
+        place, so the lock must be held while they are read.
+        """
+        if self.buckets is None:
+            self.load()
+        key = (None if category is None else str(category), difficulty)
+        return self.buckets.get(key, array('i'))
+
+    def ids(self, category=None, difficulty=None):
+        """Returns a copy of the ids of a bucket."""
+        with self.lock:
+            return array('i', self.bucket(category, difficulty))
+
+    def invalidate(self):
+        with self.lock:
+            self.buckets = None
+
+    def add(self, question_id, category, difficulty):
+        for key in self.keys(category, difficulty):
+            self.buckets.setdefault(key, array('i')).append(question_id)
+
+    def remove(self, question_id):
+        for ids in self.buckets.values():
+            if question_id in ids:
+                # Swap with the last id so removal does not shift the array
+                position = ids.index(question_id)
+                ids[position] = ids[-1]
+                ids.pop()
+
+    def changed(self, op, question):
+        with self.lock:
+            if self.buckets is None:
+                return
+            if op == 'bulk':
+                self.buckets = None
+                return
+            if op != 'insert':
+                self.remove(question.id)
+            if op != 'delete':
+                self.add(question.id, question.category, question.difficulty)
+
+    def choose(self, category=None, previous=(), difficulty=None):
+        """
+        Returns a random question id of the category, and difficulty
+        when given, that is not in the set previous, or None when every
+        such question has been played.
+        """
+        with self.lock:
+            ids = self.bucket(category, difficulty)
+            if not ids:
+                return None
+            for _ in range(MAX_REJECTIONS):
+                question_id = ids[random.randrange(len(ids))]
+                if question_id not in previous:
+                    return question_id
+            # Most of the category was already played, pick from what is
+            # left
+            remaining = [i for i in ids if i not in previous]
+        if not remaining:
+            return None
+        return random.choice(remaining)
+
+    def sample(self, count, category=None, previous=(), difficulty=None):
+        """
+        Returns up to count distinct random question ids of the
+        category, and difficulty when given, that are not in the set
+        previous.
+        """
+        chosen = []
+        excluded = set(previous)
+        with self.lock:
+            ids = self.bucket(category, difficulty)
+            if not ids or count < 1:
+                return chosen
+            for _ in range(MAX_REJECTIONS * count):
+                question_id = ids[random.randrange(len(ids))]
+                if question_id not in excluded:
+                    chosen.append(question_id)
+                    excluded.add(question_id)
+                    if len(chosen) == count:
+                        return chosen
+            # Most of the category was already played, pick from what is
+            # left
+            remaining = [i for i in ids if i not in excluded]
+        return chosen + random.sample(
+            remaining, min(count - len(chosen), len(remaining)))
+
+
+quiz_index = QuizIndex()
+on_question_change(quiz_index.changed)
+
+
+def difficulty_order(target):
+    """
+    Yields the difficulties to draw from, the target first and then
+    its neighbours, closest first.
+    """
+    yield target
+    for distance in range(1, MAX_DIFFICULTY - MIN_DIFFICULTY + 1):
+        for difficulty in (target - distance, target + distance):
+            if MIN_DIFFICULTY <= difficulty <= MAX_DIFFICULTY:
+                yield difficulty
+
+
+def target_difficulty(difficulty, correct):
+    """
+    Returns the difficulty of the next adaptive question: one level up
+    after a correct answer, one level down after a wrong one.
+    """
+    if correct is not None:
+        difficulty += 1 if correct else -1
+    return min(MAX_DIFFICULTY, max(MIN_DIFFICULTY, difficulty))
+
+
+def choose_question_id(category, previous, difficulty=None, index=quiz_index):
+    """
+    Returns a random id of a question of the category that is not in
+    the set previous, from the given difficulty or the closest one
+    that has questions left.
+    """
+    if difficulty is None:
+        return index.choose(category, previous)
+    for candidate in difficulty_order(difficulty):
+        question_id = index.choose(category, previous, candidate)
+        if question_id is not None:
+            return question_id
+    return None
+
+
+def choose_question_ids(category, previous, count, difficulty=None,
+                        index=quiz_index):
+    """
+    Returns up to count distinct random ids of questions of the
+    category that are not in the set previous, from the given
+    difficulty first and then the closest ones.
+    """
+    if difficulty is None:
+        return index.sample(count, category, previous)
+    question_ids = []
+    excluded = set(previous)
+    for candidate in difficulty_order(difficulty):
+        drawn = index.sample(count - len(question_ids), category, excluded,
+                             candidate)
+        question_ids += drawn
+        excluded.update(drawn)
+        if len(question_ids) == count:
+            break
+    return question_ids
+
+
+"""
+next_question(category, previous_questions, difficulty)
+    returns the row of a random question of the category (all
+    categories when None) that is not in previous_questions, or None
+    if there is none.
+    With a target difficulty, the question is drawn from that
+    difficulty, or the closest one that has questions left.
+"""
+def next_question(category=None, previous_questions=(), difficulty=None):
+    previous = set(previous_questions or ())
+    while True:
+        question_id = choose_question_id(category, previous, difficulty)
+        if question_id is None:
+            return None
+        question = question_query().filter(
+            Question.id == question_id).first()
+        if question is not None:
+            return question
+        # Deleted since the index was built, draw again without it
+        previous.add(question_id)
+
+
+"""
+next_round(category, previous_questions, count, difficulty)
+    returns the rows of up to count random questions of the category
+    that are not in previous_questions, loaded with a single query.
+    Fewer are returned when the category runs out of questions.
+"""
+def next_round(category=None, previous_questions=(), count=1,
+               difficulty=None):
+    previous = set(previous_questions or ())
+    questions = []
+    while len(questions) < count:
+        question_ids = choose_question_ids(
+            category, previous, count - len(questions), difficulty)
+        if not question_ids:
+            break
+        rows = {row.id: row for row in question_query().filter(
+            Question.id.in_(question_ids))}
+        questions += [rows[i] for i in question_ids if i in rows]
+        # Draw again for the questions deleted since the index was built
+        previous.update(question_ids)
+    return questions
@@ -0,0 +1,196 @@
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, orm
+
+from settings import DB_REPLICA_CHECK_INTERVAL, DB_REPLICA_PIN_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Cookie holding the time until which a client reads from the primary
+PIN_COOKIE = 'trivia_primary_until'
+
+local = threading.local()
+
+
+"""
+Replica
+    engine of a read replica with its health. The replica is pinged
+    at most once every check_interval seconds and skipped while the
+    last ping or query failed to connect.
+"""
+class Replica:
+
+    def __init__(self, url, engine_options, check_interval):
+        self.engine = create_engine(url, **engine_options)
+        self.check_interval = check_interval
+        self.up = True
+        self.next_check = 0
+        self.reads = 0
+        event.listen(self.engine, 'handle_error', self.handle_error)
+
+    def handle_error(self, context):
+        if context.is_disconnect:
+            self.mark_down()
+
+    def mark_down(self):
+        self.up = False
+        self.next_check = time.monotonic() + self.check_interval
+
+    def healthy(self):
+        now = time.monotonic()
+        if now < self.next_check:
+            return self.up
+        self.next_check = now + self.check_interval
+        try:
+            with self.engine.connect() as connection:
+                connection.execute('SELECT 1')
+            self.up = True
+        except Exception as e:
+            logger.warning('Replica %r is down: %s', self.engine.url, e)
+            self.mark_down()
+        return self.up
+
+    def status(self):
+        return {
+            'url': repr(self.engine.url),
+            'up': self.up,
+            'reads': self.reads
+        }
+
+
+"""
+ReplicaSet
+    read replicas picked in turn, skipping those that are down
+"""
+class ReplicaSet:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.replicas = []
+        self.position = 0
+
+    def configure(self, urls, engine_options=lambda url: {},
+                  check_interval=DB_REPLICA_CHECK_INTERVAL):
+        """
+        Replaces the replicas with those of urls, engine_options giving
+        the engine options of each URL.
+        """
+        replicas = [Replica(url, engine_options(url), check_interval)
+                    for url in urls]
+        with self.lock:
+            previous, self.replicas = self.replicas, replicas
+        for replica in previous:
+            replica.engine.dispose()
+
+    def choose(self):
+        """Returns the engine of the next healthy replica, or None."""
+        replicas = self.replicas
+        for _ in range(len(replicas)):
+            with self.lock:
+                replica = replicas[self.position % len(replicas)]
+                self.position += 1
+            if replica.healthy():
+                replica.reads += 1
+                return replica.engine
+        return None
+
+    def status(self):
+        return [replica.status() for replica in self.replicas]
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+
+replica_set = ReplicaSet()
+
+
+@contextmanager
+def primary():
+    """Sends the reads made inside the block to the primary."""
+    local.primary = getattr(local, 'primary', 0) + 1
+    try:
+        yield
+    finally:
+        local.primary -= 1
+
+
+def served_by_replica():
+    """Returns whether the current request read from a replica."""
+    return has_request_context() and g.get('replica_engine') is not None
+
+
+def reading_replica():
+    return (has_request_context() and g.get('read_replica', False)
+            and not getattr(local, 'primary', 0))
+
+
+"""
+RoutingSession
+    session sending the queries of read-only views to a replica and
+    everything else, including flushes, to the primary
+"""
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        if replica_set and not self._flushing and reading_replica():
+            # A request reads from a single replica
+            if 'replica_engine' not in g:
+                g.replica_engine = replica_set.choose()
+            if g.replica_engine is not None:
+                return g.replica_engine
+        return super().get_bind(mapper, clause)
+
+    def commit(self):
+        super().commit()
+        if has_request_context():
+            g.db_committed = True
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def pinned():
+    """
+    Returns whether the client wrote recently enough to read its
+    writes from the primary.
+    """
+    try:
+        return float(request.cookies.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+"""
+read_only(view)
+    lets a view read from the replicas, unless its client is pinned
+    to the primary
+"""
+def read_only(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_replica = bool(replica_set) and not pinned()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+"""
+pin_writers(response)
+    pins a client to the primary for DB_REPLICA_PIN_SECONDS after a
+    request that committed, so it reads its own writes while the
+    replicas catch up
+"""
+def pin_writers(response):
+    if replica_set and g.get('db_committed', False):
+        response.set_cookie(
+            PIN_COOKIE, str(time.time() + DB_REPLICA_PIN_SECONDS),
+            max_age=DB_REPLICA_PIN_SECONDS, httponly=True)
+    return response
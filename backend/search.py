@@ -0,0 +1,188 @@
+import math
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+
+from sqlalchemy import text
+
+from models import db, Question, on_question_change
+from replicas import primary
+from settings import SEARCH_BACKEND
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# Term weights of the question and answer text, and of prefix matches
+QUESTION_WEIGHT = 2
+ANSWER_WEIGHT = 1
+PREFIX_WEIGHT = 0.5
+
+
+def tokenize(value):
+    return TOKEN_PATTERN.findall((value or '').lower())
+
+
+"""
+MemorySearch
+    in-process inverted index of the question and answer text.
+    Every token maps to a posting list of {question id: weight}, and
+    a sorted vocabulary is kept to expand query tokens by prefix.
+    The index is built on the first search and kept in sync by the
+    question write hooks.
+"""
+class MemorySearch:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = None
+        self.vocabulary = []
+        self.documents = {}
+
+    def build(self):
+        self.postings = {}
+        self.vocabulary = []
+        self.documents = {}
+        with primary():
+            rows = db.session.query(
+                Question.id, Question.question, Question.answer).yield_per(
+                1000)
+            for question_id, question, answer in rows:
+                self.add(question_id, question, answer)
+
+    def add(self, question_id, question, answer):
+        weights = Counter()
+        for token in tokenize(question):
+            weights[token] += QUESTION_WEIGHT
+        for token in tokenize(answer):
+            weights[token] += ANSWER_WEIGHT
+        for token, weight in weights.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = {}
+                insort(self.vocabulary, token)
+            posting[question_id] = weight
+        self.documents[question_id] = list(weights)
+
+    def remove(self, question_id):
+        for token in self.documents.pop(question_id, ()):
+            posting = self.postings[token]
+            posting.pop(question_id, None)
+            if not posting:
+                del self.postings[token]
+                del self.vocabulary[bisect_left(self.vocabulary, token)]
+
+    def changed(self, op, question):
+        with self.lock:
+            if self.postings is None:
+                return
+            if op == 'bulk':
+                self.postings = None
+                return
+            self.remove(question.id)
+            if op != 'delete':
+                self.add(question.id, question.question, question.answer)
+
+    def invalidate(self):
+        with self.lock:
+            self.postings = None
+
+    def warm(self):
+        with self.lock:
+            if self.postings is None:
+                self.build()
+
+    def expand(self, token):
+        """Returns the indexed tokens that start with token."""
+        index = bisect_left(self.vocabulary, token)
+        while (index < len(self.vocabulary)
+               and self.vocabulary[index].startswith(token)):
+            yield self.vocabulary[index]
+            index += 1
+
+    def search(self, term):
+        """
+        Returns the ids of the questions matching every token of the
+        search term, exactly or by prefix, best match first.
+        """
+        with self.lock:
+            if self.postings is None:
+                self.build()
+            tokens = tokenize(term)
+            if not tokens:
+                return sorted(self.documents)
+
+            scores = None
+            total = len(self.documents)
+            for token in tokens:
+                token_scores = {}
+                for word in self.expand(token):
+                    posting = self.postings[word]
+                    weight = math.log(1 + total / len(posting))
+                    if word != token:
+                        weight *= PREFIX_WEIGHT
+                    for question_id, count in posting.items():
+                        token_scores[question_id] = token_scores.get(
+                            question_id, 0) + count * weight
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {question_id: score + token_scores[question_id]
+                              for question_id, score in scores.items()
+                              if question_id in token_scores}
+                if not scores:
+                    return []
+
+        return sorted(scores, key=lambda question_id: (
+            -scores[question_id], question_id))
+
+
+"""
+PostgresSearch
+    full-text search with a Postgres tsvector over the question and
+    answer text, backed by a GIN expression index created by
+    `flask init-db` or migrations/003_search_index.sql. Searches never
+    create it, as they may run on a read-only replica.
+"""
+class PostgresSearch:
+
+    DOCUMENT = ("setweight(to_tsvector('english', coalesce(question, '')), 'A')"
+                " || setweight(to_tsvector('english', coalesce(answer, '')), 'B')")
+
+    def create_index(self):
+        db.session.execute(text(
+            'CREATE INDEX IF NOT EXISTS questions_search_idx '
+            'ON questions USING GIN (({}))'.format(self.DOCUMENT)))
+        db.session.commit()
+
+    def changed(self, op, question):
+        # Postgres keeps the GIN index up to date itself
+        pass
+
+    def invalidate(self):
+        pass
+
+    def warm(self):
+        pass
+
+    def search(self, term):
+        tokens = tokenize(term)
+        if not tokens:
+            rows = db.session.query(Question.id).order_by(Question.id).all()
+            return [question_id for question_id, in rows]
+
+        query = ' & '.join(token + ':*' for token in tokens)
+        rows = db.session.execute(text(
+            'SELECT id FROM questions '
+            'WHERE ({0}) @@ to_tsquery(\'english\', :query) '
+            'ORDER BY ts_rank(({0}), to_tsquery(\'english\', :query)) DESC, id'
+            .format(self.DOCUMENT)), {'query': query})
+        return [question_id for question_id, in rows]
+
+
+SEARCH_BACKENDS = {
+    'memory': MemorySearch,
+    'postgres': PostgresSearch,
+}
+
+search_index = SEARCH_BACKENDS[SEARCH_BACKEND]()
+on_question_change(search_index.changed)
@@ -0,0 +1,72 @@
+import json
+import time
+
+from flask import Response, g, has_request_context
+
+from models import db, Question, Category
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Columns of a serialized row, in the order they are selected
+QUESTION_FIELDS = ['id', 'question', 'answer', 'category', 'difficulty']
+CATEGORY_FIELDS = ['id', 'type']
+
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def question_query():
+    """
+    Returns a query of the question columns as plain row tuples,
+    which skips building a Question object per row.
+    """
+    return db.session.query(
+        *[getattr(Question, field) for field in QUESTION_FIELDS])
+
+
+def category_query():
+    return db.session.query(
+        *[getattr(Category, field) for field in CATEGORY_FIELDS])
+
+
+def format_question(row):
+    return dict(zip(QUESTION_FIELDS, row))
+
+
+def format_questions(rows):
+    return [dict(zip(QUESTION_FIELDS, row)) for row in rows]
+
+
+def format_categories(rows):
+    return [dict(zip(CATEGORY_FIELDS, row)) for row in rows]
+
+
+"""
+dumps(data)
+    encodes data as compact JSON bytes with sorted keys and a trailing
+    newline, with orjson when it is installed and the standard library
+    otherwise. Both produce the same bytes.
+"""
+if orjson is not None:
+    def dumps(data):
+        return orjson.dumps(data, option=orjson.OPT_SORT_KEYS |
+                            orjson.OPT_APPEND_NEWLINE)
+else:
+    def dumps(data):
+        return (json.dumps(data, sort_keys=True, separators=(',', ':'),
+                           ensure_ascii=False) + '\n').encode('utf-8')
+
+
+"""
+json_response(data, status)
+    returns a compact JSON response of data, timing the encoding in
+    the request profile when profiling is enabled
+"""
+def json_response(data, status=200):
+    start = time.perf_counter()
+    body = dumps(data)
+    if has_request_context() and 'profile' in g:
+        g.profile['serialize_seconds'] += time.perf_counter() - start
+    return Response(body, status=status, mimetype='application/json')
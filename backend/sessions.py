@@ -0,0 +1,122 @@
+import random
+import secrets
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from settings import (QUIZ_SESSION_STORE, QUIZ_SESSION_TTL,
+                      QUIZ_SESSION_MAX, QUIZ_SESSION_REDIS_URL)
+
+
+def new_session_id():
+    return secrets.token_urlsafe(16)
+
+
+"""
+MemorySessionStore
+    keeps quiz sessions in this process, dropping the least recently
+    used one beyond max_sessions and those idle for longer than ttl
+    seconds. Every session holds the shuffled question ids still to
+    be played, last to be played first.
+"""
+class MemorySessionStore:
+
+    def __init__(self, ttl=QUIZ_SESSION_TTL, max_sessions=QUIZ_SESSION_MAX):
+        self.lock = threading.Lock()
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+
+    def create(self, question_ids):
+        session_id = new_session_id()
+        ids = array('i', question_ids)
+        random.shuffle(ids)
+        with self.lock:
+            self.sessions[session_id] = [time.monotonic() + self.ttl, ids]
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        return session_id
+
+    def pop(self, session_id):
+        """
+        Returns the next question id of a session, None when every
+        question was played, and the number of questions left. Raises
+        KeyError for an unknown or expired session.
+        """
+        now = time.monotonic()
+        with self.lock:
+            session = self.sessions[session_id]
+            if session[0] < now:
+                del self.sessions[session_id]
+                raise KeyError(session_id)
+            session[0] = now + self.ttl
+            self.sessions.move_to_end(session_id)
+            ids = session[1]
+            question_id = ids.pop() if ids else None
+            return question_id, len(ids)
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+"""
+RedisSessionStore
+    keeps quiz sessions in a Redis server, or any server speaking its
+    protocol, so that every worker can serve them. A session is a list
+    of shuffled question ids ending with 0, which marks the end of the
+    quiz and keeps the key alive once every question was played.
+"""
+class RedisSessionStore:
+
+    KEY = 'trivia:quiz-session:{}'
+
+    def __init__(self, url=QUIZ_SESSION_REDIS_URL, ttl=QUIZ_SESSION_TTL):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.watch_error = redis.WatchError
+        self.ttl = ttl
+
+    def create(self, question_ids):
+        session_id = new_session_id()
+        ids = list(question_ids)
+        random.shuffle(ids)
+        key = self.KEY.format(session_id)
+        pipeline = self.client.pipeline()
+        pipeline.rpush(key, *(ids + [0]))
+        pipeline.expire(key, self.ttl)
+        pipeline.execute()
+        return session_id
+
+    def pop(self, session_id):
+        key = self.KEY.format(session_id)
+        with self.client.pipeline() as pipeline:
+            while True:
+                try:
+                    # The 0 at the end is never popped, an empty list
+                    # would be deleted along with its expiry
+                    pipeline.watch(key)
+                    head = pipeline.lindex(key, 0)
+                    if head is None:
+                        raise KeyError(session_id)
+                    pipeline.multi()
+                    if int(head) != 0:
+                        pipeline.lpop(key)
+                    pipeline.llen(key)
+                    pipeline.expire(key, self.ttl)
+                    results = pipeline.execute()
+                except self.watch_error:
+                    # Another worker popped meanwhile, try again
+                    continue
+                question_id = int(head)
+                if question_id == 0:
+                    return None, 0
+                return question_id, results[1] - 1
+
+
+SESSION_STORES = {
+    'memory': MemorySessionStore,
+    'redis': RedisSessionStore,
+}
+
+session_store = SESSION_STORES[QUIZ_SESSION_STORE]()
@@ -6,4 +6,67 @@ DB_NAME = os.environ.get("DB_NAME")
 DB_USER=os.environ.get("DB_USER")
 DB_PASSWORD = os.environ.get("DB_PASSWORD")
 DB_TESTNAME = os.environ.get("DB_TESTNAME")
-DB_HOST = os.environ.get("DB_HOST")
\ No newline at end of file
+DB_HOST = os.environ.get("DB_HOST")
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "memory")
+CACHE_MAX_AGE = int(os.environ.get("CACHE_MAX_AGE", 0))
+# Memory of the cached GET response bodies, see ResponseCache in cache.py
+RESPONSE_CACHE_BYTES = int(os.environ.get(
+    "RESPONSE_CACHE_BYTES", 32 * 1024 * 1024))
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", 1000))
+
+
+def env_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+# Connection pool, see POOL_PROFILES in pool.py
+DB_POOL_PROFILE = os.environ.get("DB_POOL_PROFILE", "default")
+DB_POOL_SIZE = env_int("DB_POOL_SIZE")
+DB_MAX_OVERFLOW = env_int("DB_MAX_OVERFLOW")
+DB_POOL_TIMEOUT = env_int("DB_POOL_TIMEOUT")
+DB_POOL_RECYCLE = env_int("DB_POOL_RECYCLE")
+DB_STATEMENT_TIMEOUT = env_int("DB_STATEMENT_TIMEOUT")
+
+# Read replicas, see replicas.py. A comma separated list of URLs.
+DB_REPLICA_URLS = [url.strip() for url in os.environ.get(
+    "DB_REPLICA_URLS", "").split(",") if url.strip()]
+DB_REPLICA_CHECK_INTERVAL = env_int("DB_REPLICA_CHECK_INTERVAL") or 5
+DB_REPLICA_PIN_SECONDS = env_int("DB_REPLICA_PIN_SECONDS") or 5
+DB_REPLICA_TESTNAME = os.environ.get("DB_REPLICA_TESTNAME")
+
+# Request profiling, see profiling.py
+PROFILING = os.environ.get("PROFILING", "").lower() in ("1", "true", "yes")
+SLOW_QUERY_MS = env_int("SLOW_QUERY_MS")
+
+# Load the caches and indexes when the app is built, see create_app
+WARM_CACHES = os.environ.get("WARM_CACHES", "").lower() in ("1", "true", "yes")
+
+# Quiz sessions, see sessions.py
+QUIZ_SESSION_STORE = os.environ.get("QUIZ_SESSION_STORE", "memory")
+QUIZ_SESSION_TTL = env_int("QUIZ_SESSION_TTL") or 3600
+QUIZ_SESSION_MAX = env_int("QUIZ_SESSION_MAX") or 10000
+QUIZ_SESSION_REDIS_URL = os.environ.get(
+    "QUIZ_SESSION_REDIS_URL", "redis://localhost:6379/0")
+
+# Admission control of the expensive endpoints, see admission.py. A rate
+# or a concurrency limit of 0 turns it off.
+RATE_LIMIT_STORE = os.environ.get("RATE_LIMIT_STORE", "memory")
+RATE_LIMIT_REDIS_URL = os.environ.get(
+    "RATE_LIMIT_REDIS_URL", QUIZ_SESSION_REDIS_URL)
+RATE_LIMIT_PER_MINUTE = int(os.environ.get("RATE_LIMIT_PER_MINUTE", 120))
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", 20))
+DB_CONCURRENCY_LIMIT = int(os.environ.get("DB_CONCURRENCY_LIMIT", 8))
+DB_CONCURRENCY_WAIT_MS = int(os.environ.get("DB_CONCURRENCY_WAIT_MS", 100))
+
+# Cache invalidation between workers, see bus.py: postgres, memory or
+# off, auto picks postgres when the database is Postgres
+CHANGE_BUS = os.environ.get("CHANGE_BUS", "auto")
+CHANGE_BUS_CHANNEL = os.environ.get("CHANGE_BUS_CHANNEL", "trivia_changes")
+CHANGE_BUS_POLL_SECONDS = env_int("CHANGE_BUS_POLL_SECONDS") or 5
+
+# Leaderboard, see leaderboard.py
+SCORE_FLUSH_INTERVAL = env_int("SCORE_FLUSH_INTERVAL") or 5
+
+# Serve a read-only snapshot file instead of the database, see snapshot.py
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH")
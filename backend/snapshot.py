@@ -0,0 +1,266 @@
+import bisect
+import hashlib
+import mmap
+import struct
+import sys
+from array import array
+
+from models import Question, Category
+from serialize import question_query, category_query
+from quiz import QuizIndex
+
+MAGIC = b'TRIVSNAP'
+VERSION = 1
+
+# Stored in the integer columns for NULL
+NULL = -2 ** 31
+
+# Bits of the flags columns, set when the text is NULL
+NULL_QUESTION = 1
+NULL_ANSWER = 2
+NULL_TYPE = 1
+
+# Sections of the file, in the order they are written. Integer columns
+# are little-endian, texts are UTF-8 blobs indexed by offset columns
+# holding one more offset than there are rows.
+SECTIONS = [
+    ('category_ids', 'i'),
+    ('type_offsets', 'Q'),
+    ('types', 'B'),
+    ('type_flags', 'B'),
+    ('question_ids', 'i'),
+    ('categories', 'i'),
+    ('difficulties', 'i'),
+    ('flags', 'B'),
+    ('question_offsets', 'Q'),
+    ('answer_offsets', 'Q'),
+    ('texts', 'B'),
+    # Ids of the questions of each category, in category then id order,
+    # and the start of each category in it, in category_ids order
+    ('category_question_ids', 'i'),
+    ('category_starts', 'Q'),
+]
+
+# Magic, version, number of questions and categories, SHA-1 of the
+# sections, then the offset and length of every section
+HEADER = struct.Struct('<8sIII20s' + 'QQ' * len(SECTIONS))
+
+# Sections start on a multiple of 8 bytes
+ALIGNMENT = 8
+
+
+def texts_column(values):
+    """Returns the offsets and UTF-8 blob of a list of texts."""
+    offsets = array('Q', [0])
+    blob = bytearray()
+    for value in values:
+        blob += (value or '').encode('utf-8')
+        offsets.append(len(blob))
+    return offsets, blob
+
+
+def integer(value):
+    return NULL if value is None else value
+
+
+"""
+write_snapshot(path)
+    exports the questions and categories of the current app to a
+    read-only snapshot file, see Snapshot
+"""
+def write_snapshot(path):
+    categories = category_query().order_by(Category.id).all()
+    questions = question_query().order_by(Question.id).all()
+
+    type_offsets, types = texts_column([type for id, type in categories])
+    question_offsets, question_texts = texts_column(
+        [row[1] for row in questions])
+    answer_offsets, answer_texts = texts_column([row[2] for row in questions])
+    # Answers follow the questions in the texts blob
+    answer_offsets = array('Q', [offset + len(question_texts)
+                                 for offset in answer_offsets])
+
+    by_category = {}
+    for id, question, answer, category, difficulty in questions:
+        by_category.setdefault(category, array('i')).append(id)
+    category_question_ids = array('i')
+    category_starts = array('Q')
+    for id, type in categories:
+        category_starts.append(len(category_question_ids))
+        category_question_ids += by_category.get(id, array('i'))
+    category_starts.append(len(category_question_ids))
+
+    columns = {
+        'category_ids': array('i', [id for id, type in categories]),
+        'type_offsets': type_offsets,
+        'types': types,
+        'type_flags': bytes(NULL_TYPE if type is None else 0
+                            for id, type in categories),
+        'question_ids': array('i', [row[0] for row in questions]),
+        'categories': array('i', [integer(row[3]) for row in questions]),
+        'difficulties': array('i', [integer(row[4]) for row in questions]),
+        'flags': bytes((NULL_QUESTION if row[1] is None else 0) |
+                       (NULL_ANSWER if row[2] is None else 0)
+                       for row in questions),
+        'question_offsets': question_offsets,
+        'answer_offsets': answer_offsets,
+        'texts': question_texts + answer_texts,
+        'category_question_ids': category_question_ids,
+        'category_starts': category_starts,
+    }
+
+    body = bytearray()
+    positions = []
+    digest = hashlib.sha1()
+    for name, typecode in SECTIONS:
+        data = columns[name]
+        if isinstance(data, array):
+            if sys.byteorder != 'little':
+                data = array(typecode, data)
+                data.byteswap()
+            data = data.tobytes()
+        body += bytes(-(HEADER.size + len(body)) % ALIGNMENT)
+        positions += [HEADER.size + len(body), len(data)]
+        body += data
+        digest.update(data)
+
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(questions),
+                               len(categories), digest.digest(), *positions))
+        file.write(body)
+    return len(questions), len(categories)
+
+
+"""
+Snapshot
+    read-only questions and categories of a snapshot file, mapped in
+    memory. Every column is a memoryview on the file, so opening a
+    snapshot reads nothing but its header, and a question is decoded
+    only when it is served. Questions are found by id with a binary
+    search on the sorted ids, and the questions of a category are a
+    slice of the category_question_ids column.
+"""
+class Snapshot:
+
+    def __init__(self, path):
+        if sys.byteorder != 'little':
+            raise ValueError('Snapshots are only served on little-endian hosts')
+        self.path = path
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self.map)
+        magic, version, self.question_count, self.category_count, digest = (
+            header[:5])
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{} is not a version {} snapshot'.format(
+                path, VERSION))
+        self.digest = digest.hex()
+
+        view = memoryview(self.map)
+        for (name, typecode), offset, length in zip(
+                SECTIONS, header[5::2], header[6::2]):
+            setattr(self, name, view[offset:offset + length].cast(typecode))
+
+        self.category_positions = {
+            id: position for position, id in enumerate(self.category_ids)}
+
+    def size(self):
+        return len(self.map)
+
+    @staticmethod
+    def text(blob, offsets, position):
+        return str(blob[offsets[position]:offsets[position + 1]], 'utf-8')
+
+    def row(self, position):
+        """Returns the question at position as a question_query row."""
+        flags = self.flags[position]
+        category = self.categories[position]
+        difficulty = self.difficulties[position]
+        return (
+            self.question_ids[position],
+            None if flags & NULL_QUESTION else self.text(
+                self.texts, self.question_offsets, position),
+            None if flags & NULL_ANSWER else self.text(
+                self.texts, self.answer_offsets, position),
+            None if category == NULL else category,
+            None if difficulty == NULL else difficulty)
+
+    def question(self, question_id):
+        """Returns the row of a question, or None."""
+        position = bisect.bisect_left(self.question_ids, question_id)
+        if (position == len(self.question_ids) or
+                self.question_ids[position] != question_id):
+            return None
+        return self.row(position)
+
+    def questions(self, question_ids):
+        rows = [self.question(question_id) for question_id in question_ids]
+        return [row for row in rows if row is not None]
+
+    def type(self, position):
+        if self.type_flags[position] & NULL_TYPE:
+            return None
+        return self.text(self.types, self.type_offsets, position)
+
+    def category_type(self, category_id):
+        position = self.category_positions.get(category_id)
+        if position is None:
+            return None
+        return self.type(position)
+
+    def category_types(self):
+        """Returns the category types in id order, as category_cache."""
+        return [self.type(position) for position in range(self.category_count)]
+
+    def ids(self, category_id=None):
+        """
+        Returns the sorted question ids of a category, or of every
+        question when None.
+        """
+        if category_id is None:
+            return self.question_ids
+        position = self.category_positions.get(category_id)
+        if position is None:
+            return self.category_question_ids[0:0]
+        return self.category_question_ids[
+            self.category_starts[position]:self.category_starts[position + 1]]
+
+    def rows(self):
+        for position in range(self.question_count):
+            yield self.row(position)
+
+    def status(self):
+        return {
+            'path': self.path,
+            'bytes': self.size(),
+            'sha1': self.digest,
+            'questions': self.question_count,
+            'categories': self.category_count
+        }
+
+
+"""
+SnapshotQuizIndex
+    quiz index of the questions of a snapshot. Questions are drawn
+    from the id columns of the file, and the difficulty buckets are
+    loaded from its columns the first time an adaptive quiz needs them.
+"""
+class SnapshotQuizIndex(QuizIndex):
+
+    def __init__(self, snapshot):
+        super().__init__()
+        self.snapshot = snapshot
+
+    def bucket(self, category, difficulty):
+        if difficulty is None:
+            return self.snapshot.ids(category)
+        return super().bucket(category, difficulty)
+
+    def load(self):
+        self.buckets = {}
+        snapshot = self.snapshot
+        for question_id, category, difficulty in zip(
+                snapshot.question_ids, snapshot.categories,
+                snapshot.difficulties):
+            self.add(question_id, None if category == NULL else category,
+                     None if difficulty == NULL else difficulty)
@@ -1,25 +1,222 @@
 import os
+import asyncio
+import gc
+import gzip
+import tempfile
+import time
 import unittest
+import warnings
 import json
-from flask_sqlalchemy import SQLAlchemy
+
+from sqlalchemy import create_engine, event
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from asgi import create_asgi_app
+from models import (init_db, db, Question, Category, apply_question_change,
+                    apply_category_change, question_listeners)
+from search import search_index
+from leaderboard import Leaderboard, leaderboard, UPSERT_SCORES
+from snapshot import write_snapshot
+from cache import response_caches
+from replicas import replica_set
+from pool import engine_options, pool_status
+from bus import ChangeBus
+from benchmarks.data import read_table, TRIVIA_DUMP
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+from settings import (DB_TESTNAME, DB_USER, DB_HOST, DB_REPLICA_TESTNAME,
+                      SEARCH_BACKEND)
+
+# Seconds the whole suite may take before it fails, 0 for no limit
+TEST_TIME_BUDGET = float(os.environ.get('TEST_TIME_BUDGET', 30))
+
+# Each pytest-xdist worker gets its own Postgres schema
+TEST_SCHEMA = 'test_{}'.format(os.environ.get('PYTEST_XDIST_WORKER', 'main'))
+
+
+def database_path_for_tests():
+    """
+    Returns the Postgres database of DB_TESTNAME, or an in-memory
+    SQLite database of this process when it is not set.
+    """
+    if DB_TESTNAME:
+        return 'postgres://{}@{}/{}'.format(DB_USER, DB_HOST, DB_TESTNAME)
+    return 'sqlite://'
+
+
+def use_test_schema(app):
+    """Makes the Postgres connections of app use TEST_SCHEMA."""
+    options = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    connect_args = dict(options.get('connect_args', {}))
+    connect_args['options'] = '{} -c search_path={}'.format(
+        connect_args.get('options', ''), TEST_SCHEMA).strip()
+    options['connect_args'] = connect_args
+
+
+def sample_rows():
+    """Returns the category and question rows of trivia.psql."""
+    with open(TRIVIA_DUMP, encoding='utf-8') as f:
+        dump = f.read()
+    categories = [{'id': int(id), 'type': type}
+                  for id, type in read_table(dump, 'categories')]
+    questions = [
+        {'id': int(id), 'question': question, 'answer': answer,
+         'difficulty': int(difficulty), 'category': int(category)}
+        for id, question, answer, difficulty, category in read_table(
+            dump, 'questions')]
+    return categories, questions
+
 
-from settings import DB_TESTNAME, DB_USER, DB_HOST
+def load_sample_data():
+    """Inserts the categories and questions of trivia.psql."""
+    categories, questions = sample_rows()
+    db.session.execute(Category.__table__.insert(), categories)
+    db.session.execute(Question.__table__.insert(), questions)
+    if db.engine.dialect.name == 'postgresql':
+        for table in ('categories', 'questions'):
+            db.session.execute(
+                "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                "(SELECT MAX(id) FROM {0}))".format(table))
+    db.session.commit()
+
+
+def call_asgi(app, requests):
+    """
+    Sends (method, path, body, client address) requests to an ASGI app
+    one after the other, and returns their status, headers, body and
+    number of body messages.
+    """
+    async def call(method, path, body, client):
+        path, _, query_string = path.partition('?')
+        scope = {'type': 'http', 'http_version': '1.1', 'method': method,
+                 'scheme': 'http', 'path': path, 'root_path': '',
+                 'query_string': query_string.encode(),
+                 'headers': [(b'host', b'testserver'),
+                             (b'content-type', b'application/json')],
+                 'client': (client, 50000), 'server': ('testserver', 80)}
+        messages = [{'type': 'http.request', 'body': body}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await app(scope, receive, send)
+        headers = {name.decode(): value.decode()
+                   for name, value in sent[0]['headers']}
+        return (sent[0]['status'], headers,
+                b''.join(message.get('body', b'') for message in sent[1:]),
+                len(sent) - 1)
+
+    async def run():
+        await app.database.connect()
+        try:
+            return [await call(*request) for request in requests]
+        finally:
+            await app.database.close()
+            app.executor.shutdown(wait=False)
+
+    return asyncio.run(run())
+
+
+def restart_savepoint(session, transaction):
+    # The views commit, which releases the savepoint of the test
+    if transaction.nested and not transaction._parent.nested:
+        session.expire_all()
+        session.begin_nested()
 
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
+    @classmethod
+    def setUpClass(cls):
+        """
+        Build the app, its schema and the sample data once for every
+        test.
+        """
+        cls.started = time.perf_counter()
+        cls.durations = {}
+        cls.database_path = database_path_for_tests()
+        cls.app = cls.create_test_app()
+        cls.context = cls.app.app_context()
+        cls.context.push()
+        if DB_TESTNAME:
+            db.engine.execute('DROP SCHEMA IF EXISTS {0} CASCADE; '
+                              'CREATE SCHEMA {0}'.format(TEST_SCHEMA))
+        init_db()
+        if SEARCH_BACKEND == 'postgres':
+            search_index.create_index()
+        load_sample_data()
+        db.session.remove()
+
+    @classmethod
+    def tearDownClass(cls):
+        if DB_TESTNAME:
+            db.engine.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(
+                TEST_SCHEMA))
+        cls.context.pop()
+
+        elapsed = time.perf_counter() - cls.started
+        slowest = sorted(cls.durations.items(), key=lambda item: -item[1])
+        print('\n{} tests in {:.2f} s (budget {:.0f} s), slowest: {}'.format(
+            len(cls.durations), elapsed, TEST_TIME_BUDGET, ', '.join(
+                '{} {:.0f} ms'.format(name, seconds * 1000)
+                for name, seconds in slowest[:5])))
+        if TEST_TIME_BUDGET and elapsed > TEST_TIME_BUDGET:
+            raise AssertionError(
+                'The suite took {:.2f} s, over its {:.0f} s budget'.format(
+                    elapsed, TEST_TIME_BUDGET))
+
+    def sample_database(self):
+        """
+        Returns the URL of a new SQLite file with the sample data, for
+        the tests needing a second database or one the async drivers
+        can open.
+        """
+        path = os.path.join(tempfile.mkdtemp(), 'trivia.db')
+        self.addCleanup(os.remove, path)
+        engine = create_engine('sqlite:///' + path)
+        db.Model.metadata.create_all(engine)
+        categories, questions = sample_rows()
+        with engine.begin() as connection:
+            connection.execute(Category.__table__.insert(), categories)
+            connection.execute(Question.__table__.insert(), questions)
+        engine.dispose()
+        return 'sqlite:///' + path
+
+    @classmethod
+    def create_test_app(cls, **config):
+        """Builds an app on the test database."""
+        app = create_app(dict({'SQLALCHEMY_DATABASE_URI': cls.database_path,
+                               'TESTING': True}, **config))
+        if DB_TESTNAME:
+            use_test_schema(app)
+        return app
+
     def setUp(self):
-        """Define test variables and initialize app."""
-        self.app = create_app()
+        """
+        Define test variables, and run the test in a savepoint of a
+        transaction that is rolled back after it.
+        """
+        self.started = time.perf_counter()
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        self.session = db.session
+        db.session = db.create_scoped_session(
+            options={'bind': self.connection, 'binds': {}})
+        # Other apps built by the tests must not close the session
+        db.session.remove = lambda: None
+        event.listen(db.session, 'after_transaction_end', restart_savepoint)
+        db.session.begin_nested()
+
         self.client = self.app.test_client
-        self.database_name = "trivia_test"
-        self.database_path = "postgres://{}@{}/{}".format(
-            DB_USER, DB_HOST, DB_TESTNAME)
-        setup_db(self.app, self.database_path)
         self.new_question = {
             'question': 'Who is she? A singer?',
             'answer': 'She is much more than a singer chris. She is a queen.',
@@ -33,16 +230,25 @@ class TriviaTestCase(unittest.TestCase):
                 'id': '3'
             }
         }
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
 
     def tearDown(self):
-        """Executed after reach test"""
-        pass
+        """Roll back the writes of the test and reload what they changed."""
+        event.remove(db.session, 'after_transaction_end', restart_savepoint)
+        db.session.close()
+        db.session = self.session
+        self.transaction.rollback()
+        with warnings.catch_warnings():
+            # SQLAlchemy 1.3 warns on closing a connection whose savepoints
+            # were released, the transaction is rolled back all the same
+            warnings.filterwarnings('ignore', 'Reset agent is not active')
+            self.connection.close()
+        apply_question_change('bulk', None)
+        apply_category_change('bulk', None)
+        # Scores are never flushed in the tests, drop those of the test
+        leaderboard.pending.clear()
+        leaderboard.invalidate()
+        self.durations[self.id().split('.')[-1]] = (
+            time.perf_counter() - self.started)
 
     """
     TODO
@@ -69,6 +275,44 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'resource not found')
 
+    def test_cursor_paginated_questions(self):
+        res = self.client().get('/questions?after=0&limit=2')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['questions']), 2)
+        self.assertEqual(data['next_cursor'], data['questions'][-1]['id'])
+
+        res = self.client().get(
+            '/questions?after={}&limit=2'.format(data['next_cursor']))
+        next_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertGreater(next_data['questions'][0]['id'], data['next_cursor'])
+
+    def test_400_cursor_limit_too_large(self):
+        responses = [
+            self.client().get('/questions?after=0&limit=1000'),
+            self.client().get('/categories/1/questions?after=0&limit=0'),
+            self.client().post('/questions/search?after=0&limit=1000',
+                               json={'searchTerm': 'title'})]
+
+        self.assertEqual([res.status_code for res in responses],
+                         [400, 400, 400])
+        self.assertEqual(json.loads(responses[0].data)['success'], False)
+
+    def test_compact_json_questions(self):
+        res = self.client().get('/questions')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/json')
+        self.assertEqual(res.data.count(b'\n'), 1)
+        self.assertEqual(set(data['questions'][0]),
+                         {'id', 'question', 'answer', 'category',
+                          'difficulty'})
+
    # Test categories
     def test_get_categories(self):
         res = self.client().get('/categories')
@@ -78,6 +322,40 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['categories'])
 
+    def test_304_get_categories_not_modified(self):
+        res = self.client().get('/categories')
+        etag = res.headers['ETag']
+
+        res = self.client().get('/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+    def test_workers_give_the_same_etag(self):
+        worker = self.create_test_app().test_client()
+        etag = self.client().get('/categories').headers['ETag']
+        # The other worker counted a write that did not change the body
+        apply_category_change('bulk', None)
+        res = worker.get('/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+
+    def test_create_category_changes_etag(self):
+        res = self.client().get('/categories')
+        etag = res.headers['ETag']
+
+        res = self.client().post('/categories', json={'type': 'Music'})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['created'])
+
+        res = self.client().get('/categories', headers={'If-None-Match': etag})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('Music', data['categories'])
+
     def test_422_get_categories(self):
         res = self.client().delete('/categories')
         data = json.loads(res.data)
@@ -88,7 +366,7 @@ class TriviaTestCase(unittest.TestCase):
 
     # Test delete question
     def test_delete_question(self):
-        res = self.client().delete('/questions/3')
+        res = self.client().delete('/questions/10')
         data = json.loads(res.data)
         question = Question.query.filter(Question.id == 10).one_or_none()
 
@@ -100,7 +378,7 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(question, None)
 
     def test_404_delete_unavailable_question(self):
-        res = self.client().delete('/questions/10')
+        res = self.client().delete('/questions/1000')
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 404)
@@ -117,6 +395,16 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['created'])
         self.assertTrue(data['total_questions'])
 
+    def test_total_questions_after_create(self):
+        res = self.client().get('/questions')
+        total = json.loads(res.data)['total_questions']
+
+        res = self.client().post('/questions', json=self.new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], total + 1)
+
     def test_405_question_creation_not_allowed(self):
         res = self.client().post('/questions/8', json=self.new_question)
         data = json.loads(res.data)
@@ -125,6 +413,111 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'method not allowed')
 
+    # Test bulk import and export
+    def test_bulk_create_questions(self):
+        body = '\n'.join([
+            json.dumps(self.new_question),
+            json.dumps(self.new_question),
+            json.dumps({'question': 'No answer', 'category': 2,
+                        'difficulty': 1})
+        ])
+        res = self.client().post('/questions/bulk', data=body,
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual(data['failed'], 1)
+        self.assertEqual(data['errors'][0]['line'], 3)
+
+    def test_bulk_rejects_rows_with_wrong_types(self):
+        body = '\n'.join([
+            json.dumps(self.new_question),
+            json.dumps(dict(self.new_question, question=42)),
+            json.dumps(dict(self.new_question, difficulty=True))
+        ])
+        res = self.client().post('/questions/bulk', data=body,
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['failed'], 2)
+        self.assertEqual(data['errors'][0]['error'],
+                         'question must be a string')
+
+    def test_422_bulk_body_not_utf8(self):
+        # Larger than the chunks the body is decoded in
+        body = (json.dumps(self.new_question) + '\n').encode('utf-8') * 200
+        res = self.client().post('/questions/bulk?batch_size=10',
+                                 data=body + b'\xff\xfe\n',
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['completed'], False)
+        self.assertEqual(len(data['errors']), 1)
+        self.assertGreater(data['inserted'], 0)
+        self.assertEqual(data['total_questions'], 19 + data['inserted'])
+
+    def test_batch_questions(self):
+        operations = [
+            dict(self.new_question, op='create'),
+            {'op': 'update', 'id': 2, 'difficulty': 9},
+            {'op': 'delete', 'id': 1000}
+        ]
+        res = self.client().post('/questions/batch', json={
+            'operations': operations})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['applied'], 1)
+        self.assertEqual(data['failed'], 2)
+        self.assertEqual(data['results'][2]['index'], 2)
+        self.assertEqual(data['results'][2]['success'], False)
+
+    def test_batch_reports_operations_with_wrong_types(self):
+        res = self.client().post('/questions/batch', json={'operations': [
+            dict(self.new_question, op='create'),
+            dict(self.new_question, op='create', answer=['not', 'text']),
+            {'op': 'update', 'id': 2, 'question': {'text': 'x'}},
+            {'op': 'delete', 'id': True}
+        ]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['applied'], 1)
+        self.assertEqual(data['failed'], 3)
+        self.assertEqual([result['success'] for result in data['results']],
+                         [True, False, False, False])
+        self.assertEqual(data['results'][1]['error'], 'answer must be a string')
+
+    def test_422_atomic_batch_rolled_back(self):
+        total = json.loads(self.client().get('/questions').data)[
+            'total_questions']
+        res = self.client().post('/questions/batch', json={
+            'operations': [dict(self.new_question, op='create'),
+                           {'op': 'delete', 'id': 1000}],
+            'atomic': True})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['committed'], False)
+        self.assertEqual(data['total_questions'], total)
+
+    def test_export_questions(self):
+        res = self.client().get('/questions/export')
+        rows = [json.loads(line) for line in res.data.splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(rows)
+        self.assertEqual(set(rows[0]), {'id', 'question', 'answer',
+                                        'category', 'difficulty'})
+
     # Test search questions
     def test_search_question(self):
         res = self.client().post('/questions', json={"searchTerm": "title"})
@@ -145,6 +538,16 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['total_questions'])
 
+    def test_search_matches_answers_and_prefixes(self):
+        res = self.client().post(
+            '/questions/search', json={"searchTerm": "scissor"})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['total_questions'])
+        self.assertIn('Scissorhands', data['questions'][0]['answer'])
+
     # Test get questions by category
 
     def test_questions_by_categories(self):
@@ -174,6 +577,129 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['question']['category'], '3')
 
+    def test_quiz_skips_previous_questions(self):
+        quiz = {
+            'previous_questions': [13, 14],
+            'quiz_category': {
+                'type': 'Geography',
+                'id': '2'
+            }
+        }
+        res = self.client().post('/quizzes', json=quiz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertNotIn(data['question']['id'], quiz['previous_questions'])
+
+    def test_quiz_round(self):
+        quiz = {
+            'previous_questions': [13],
+            'quiz_category': {
+                'type': 'click',
+                'id': 0
+            },
+            'count': 5
+        }
+        res = self.client().post('/quizzes/round', json=quiz)
+        data = json.loads(res.data)
+        ids = [question['id'] for question in data['questions']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(len(set(ids)), 5)
+        self.assertNotIn(13, ids)
+
+    def test_400_quiz_round_too_long(self):
+        res = self.client().post('/quizzes/round', json={
+            'previous_questions': [],
+            'quiz_category': {'type': 'click', 'id': 0},
+            'count': 1000})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_400_quiz_round_bad_body(self):
+        no_body = self.client().post('/quizzes/round')
+        not_json = self.client().post('/quizzes/round', data='count=5',
+                                      content_type='text/plain')
+        bool_count = self.client().post('/quizzes/round', json={
+            'previous_questions': [],
+            'quiz_category': {'type': 'click', 'id': 0},
+            'count': True})
+
+        self.assertEqual(no_body.status_code, 400)
+        self.assertEqual(not_json.status_code, 400)
+        self.assertEqual(bool_count.status_code, 400)
+        self.assertEqual(json.loads(bool_count.data)['success'], False)
+
+    def test_adaptive_quiz_raises_difficulty(self):
+        # Geography has questions of difficulty 2 and 3
+        quiz = {'previous_questions': [],
+                'quiz_category': {'type': 'Geography', 'id': '2'},
+                'difficulty': 2, 'correct': True}
+        res = self.client().post('/quizzes', json=quiz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['question']['difficulty'], 3)
+        self.assertEqual(data['difficulty'], 3)
+
+    def test_quiz_session_plays_question_without_difficulty_once(self):
+        question = dict(self.new_question)
+        del question['difficulty']
+        res = self.client().post('/questions', json=question)
+        question_id = json.loads(res.data)['created']
+        res = self.client().post('/quizzes/sessions', json={
+            'previous_questions': [], 'quiz_category': {'type': 'click'}})
+        data = json.loads(res.data)
+
+        played = []
+        for _ in range(data['total_questions'] + 1):
+            res = self.client().get(
+                '/quizzes/sessions/{}/next'.format(data['session_id']))
+            question = json.loads(res.data)['question']
+            if question:
+                played.append(question['id'])
+
+        self.assertEqual(data['total_questions'],
+                         db.session.query(Question).count())
+        self.assertEqual(len(played), data['total_questions'])
+        self.assertEqual(len(played), len(set(played)))
+        self.assertIn(question_id, played)
+
+    def test_quiz_session_plays_each_question_once(self):
+        res = self.client().post('/quizzes/sessions', json=self.quiz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['session_id'])
+
+        played = []
+        for _ in range(data['total_questions']):
+            res = self.client().get(
+                '/quizzes/sessions/{}/next'.format(data['session_id']))
+            question = json.loads(res.data)['question']
+            if question:
+                played.append(question['id'])
+        res = self.client().get(
+            '/quizzes/sessions/{}/next'.format(data['session_id']))
+
+        self.assertEqual(len(played), len(set(played)))
+        self.assertEqual(json.loads(res.data)['question'], None)
+
+    def test_404_unknown_quiz_session(self):
+        res = self.client().get('/quizzes/sessions/unknown/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
     def test_404_quiz_not_found(self):
         quiz = {
             'previous_questions': [8],
@@ -189,6 +715,338 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'resource not found')
 
+    # Test metrics
+    # Test leaderboard
+    def test_submit_score(self):
+        res = self.client().post('/scores', json={
+            'player': 'queen',
+            'quiz_category': self.quiz['quiz_category'],
+            'correct': 4})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertGreaterEqual(data['points'], 4)
+        self.assertGreaterEqual(data['rank'], 1)
+
+    def test_422_submit_score_without_player(self):
+        res = self.client().post('/scores', json={
+            'quiz_category': self.quiz['quiz_category'],
+            'correct': 4})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
+    def test_422_submit_score_correct_not_integer(self):
+        res = self.client().post('/scores', json={
+            'player': 'queen',
+            'quiz_category': self.quiz['quiz_category'],
+            'correct': True})
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_leaderboard_reloads_scores_of_other_workers(self):
+        client = self.create_test_app(CHANGE_BUS='memory').test_client()
+        client.post('/scores', json={
+            'player': 'queen',
+            'quiz_category': self.quiz['quiz_category'],
+            'correct': 4})
+        client.get('/leaderboard')
+        # Another worker flushes the score of a player
+        db.session.execute(UPSERT_SCORES, {
+            'player': 'king', 'category': 0, 'points': 50, 'games': 1})
+        db.session.commit()
+        worker = ChangeBus()
+        worker.start('memory')
+        worker.publish('scores', None, 'bulk')
+        worker.stop()
+        data = json.loads(client.get('/leaderboard').data)
+        points = {row['player']: row['points'] for row in data['leaderboard']}
+
+        self.assertEqual(data['leaderboard'][0]['player'], 'king')
+        # The unflushed score of this worker is still ranked
+        self.assertEqual(points['queen'], 4)
+
+    @unittest.skipUnless(hasattr(os, 'register_at_fork'), 'no fork')
+    def test_forked_worker_starts_its_own_flusher(self):
+        board = Leaderboard()
+        board.start(self.app, interval=3600)
+        board.ensure_started()
+        pid = os.fork()
+        if pid == 0:
+            # The thread of the parent did not survive the fork
+            inherited = board.flusher is not None
+            board.ensure_started()
+            os._exit(0 if not inherited and board.flusher.is_alive() else 1)
+        _, status = os.waitpid(pid, 0)
+
+        self.assertTrue(board.flusher.is_alive())
+        self.assertEqual(status, 0)
+
+    def test_category_leaderboard(self):
+        self.client().post('/scores', json={
+            'player': 'queen',
+            'quiz_category': self.quiz['quiz_category'],
+            'correct': 2})
+        res = self.client().get('/categories/4/leaderboard?limit=5')
+        data = json.loads(res.data)
+        points = [row['points'] for row in data['leaderboard']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['leaderboard'])
+        self.assertLessEqual(len(points), 5)
+        self.assertEqual(points, sorted(points, reverse=True))
+
+    def test_gzip_cached_questions(self):
+        res = self.client().get('/questions')
+        gzip_res = self.client().get('/questions',
+                                     headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(gzip_res.status_code, 200)
+        self.assertEqual(gzip_res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', gzip_res.headers['Vary'])
+        self.assertEqual(gzip.decompress(gzip_res.data), res.data)
+
+    def test_apps_do_not_leak_response_caches(self):
+        self.create_test_app()
+        gc.collect()
+        listeners, caches = len(question_listeners), len(response_caches)
+        for _ in range(3):
+            self.create_test_app()
+        gc.collect()
+
+        self.assertEqual(len(question_listeners), listeners)
+        self.assertLessEqual(len(response_caches), caches)
+
+    def test_engine_uses_options_set_after_create_app(self):
+        # As use_test_schema sets the search_path of the test schema
+        app = self.create_test_app()
+        app.config['SQLALCHEMY_ENGINE_OPTIONS']['execution_options'] = {
+            'configured': 'late'}
+        engine = db.get_engine(app)
+        self.addCleanup(engine.dispose)
+
+        self.assertEqual(engine.get_execution_options()['configured'], 'late')
+
+    def test_write_of_other_worker_changes_etag(self):
+        client = self.create_test_app(CHANGE_BUS='memory').test_client()
+        etag = client.get('/categories').headers['ETag']
+        # Another worker inserts a category, without the write hooks
+        # of this one
+        db.session.execute(Category.__table__.insert(),
+                           {'id': 7, 'type': 'Music'})
+        db.session.commit()
+        worker = ChangeBus()
+        worker.start('memory')
+        worker.publish('categories', 7, 'insert')
+        worker.stop()
+        res = client.get('/categories', headers={'If-None-Match': etag})
+        metrics = json.loads(client.get('/metrics').data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+        self.assertEqual(metrics['change_bus']['backend'], 'MemoryBackend')
+        self.assertGreaterEqual(metrics['change_bus']['received'], 1)
+        self.assertIn('p95', metrics['change_bus']['latency_ms'])
+
+    def test_429_quiz_rate_limited(self):
+        app = self.create_test_app(RATE_LIMIT_PER_MINUTE=60,
+                                   RATE_LIMIT_BURST=2)
+        client = app.test_client()
+        for _ in range(2):
+            client.post('/quizzes', json=self.quiz)
+        res = client.post('/quizzes', json=self.quiz)
+        data = json.loads(res.data)
+        metrics = json.loads(client.get('/metrics').data)
+
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(res.headers['Retry-After'], '1')
+        self.assertEqual(
+            metrics['admission']['routes']['play_quiz']['rate_limited'], 1)
+
+    def test_get_metrics(self):
+        before = json.loads(self.client().get('/metrics').data)['pool']
+        # The tests share one connection, check out from a pool of its own
+        path = os.path.join(tempfile.mkdtemp(), 'pool.db')
+        self.addCleanup(os.remove, path)
+        engine = create_engine('sqlite:///' + path,
+                               **engine_options('worker'))
+        self.addCleanup(engine.dispose)
+        with engine.connect():
+            with engine.connect():
+                held = pool_status(engine)
+        released = pool_status(engine)
+        res = self.client().get('/metrics')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['pool']['checkouts'], before['checkouts'] + 2)
+        self.assertEqual(data['pool']['timeouts'], before['timeouts'])
+        self.assertGreaterEqual(data['pool']['wait_seconds_total'],
+                                before['wait_seconds_total'])
+        self.assertGreaterEqual(data['pool']['wait_seconds_max'], 0)
+        self.assertEqual(
+            sum(data['pool']['checkout_latency_histogram'].values()),
+            data['pool']['checkouts'])
+        self.assertEqual(held['class'], 'InstrumentedQueuePool')
+        self.assertEqual(held['size'], 2)
+        self.assertEqual(held['checked_out'], 2)
+        self.assertEqual(held['checked_in'], 0)
+        self.assertEqual(held['overflow'], 0)
+        self.assertEqual(released['checked_out'], 0)
+        self.assertEqual(released['checked_in'], 2)
+
+    def test_server_timing_header(self):
+        client = self.create_test_app(PROFILING=True).test_client()
+        res = client.get('/questions')
+        data = json.loads(client.get('/metrics').data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('db;dur=', res.headers['Server-Timing'])
+        self.assertIn('get_questions', data['requests'])
+
+    def test_failed_query_drops_its_start(self):
+        self.create_test_app(PROFILING=True)
+        with db.engine.connect() as connection:
+            with self.assertRaises(Exception):
+                connection.execute('SELECT * FROM no_such_table')
+            connection.execute('SELECT 1')
+
+            self.assertEqual(connection.info.get('query_start'), [])
+
+    def test_slow_query_logged(self):
+        app = self.create_test_app(SLOW_QUERY_MS=1e-9)
+        with app.app_context():
+            with self.assertLogs('profiling', 'WARNING') as logs:
+                db.session.execute('SELECT 1')
+
+        self.assertIn('Slow query', logs.output[0])
+
+    def test_snapshot_same_responses(self):
+        path = os.path.join(tempfile.mkdtemp(), 'trivia.snapshot')
+        self.addCleanup(os.remove, path)
+        write_snapshot(path)
+        snapshot = create_app({'SNAPSHOT_PATH': path}).test_client()
+
+        for url in ['/categories', '/questions?page=2',
+                    '/categories/1/questions', '/questions?after=5&limit=3',
+                    '/questions?page=1000']:
+            res = self.client().get(url)
+            snapshot_res = snapshot.get(url)
+            self.assertEqual(snapshot_res.status_code, res.status_code)
+            self.assertEqual(snapshot_res.data, res.data)
+
+        res = snapshot.post('/quizzes', json=self.quiz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['category'], 4)
+        self.assertNotEqual(data['question']['id'], 8)
+
+    def test_405_snapshot_is_read_only(self):
+        path = os.path.join(tempfile.mkdtemp(), 'trivia.snapshot')
+        self.addCleanup(os.remove, path)
+        write_snapshot(path)
+        res = create_app({'SNAPSHOT_PATH': path}).test_client().post(
+            '/questions', json=self.new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 405)
+        self.assertEqual(data['success'], False)
+
+    def test_replica_reads_and_read_your_writes(self):
+        # The replica is a second database that does not follow the
+        # primary, so it never sees the questions created here
+        if DB_REPLICA_TESTNAME:
+            replica_url = 'postgres://{}@{}/{}'.format(
+                DB_USER, DB_HOST, DB_REPLICA_TESTNAME)
+        else:
+            replica_url = self.sample_database()
+        app = self.create_test_app(SQLALCHEMY_REPLICA_URLS=[replica_url])
+        # The replicas are shared by the apps, drop them after the test
+        self.addCleanup(replica_set.configure, [])
+        writer = app.test_client()
+        res = writer.post('/questions', json=self.new_question)
+        created = json.loads(res.data)['created']
+        path = '/questions?after={}&limit=1'.format(created - 1)
+
+        self.assertIn('trivia_primary_until', res.headers['Set-Cookie'])
+
+        # Read from the replica first, its body must not be cached
+        replica = json.loads(app.test_client().get(path).data)
+        pinned = json.loads(writer.get(path).data)
+        metrics = json.loads(writer.get('/metrics').data)
+
+        self.assertEqual(pinned['questions'][0]['id'], created)
+        self.assertNotIn(created, [q['id'] for q in replica['questions']])
+        self.assertEqual(metrics['replicas'][0]['up'], True)
+
+    def test_reads_fall_back_to_primary_when_replica_down(self):
+        missing = os.path.join(tempfile.mkdtemp(), 'missing', 'trivia.db')
+        app = self.create_test_app(
+            SQLALCHEMY_REPLICA_URLS=['sqlite:///' + missing])
+        self.addCleanup(replica_set.configure, [])
+        client = app.test_client()
+        res = client.get('/questions?page=2')
+        metrics = json.loads(client.get('/metrics').data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, self.client().get('/questions?page=2').data)
+        self.assertEqual(metrics['replicas'][0]['up'], False)
+        self.assertEqual(metrics['replicas'][0]['reads'], 0)
+
+
+    @unittest.skipUnless(aiosqlite, 'aiosqlite is not installed')
+    def test_asgi_same_responses(self):
+        app = create_asgi_app({
+            'SQLALCHEMY_DATABASE_URI': self.sample_database(),
+            'TESTING': True})
+        requests = [
+            ('GET', '/categories', b''),
+            ('GET', '/questions?page=2', b''),
+            ('GET', '/questions?after=5&limit=3', b''),
+            ('GET', '/categories/1/questions', b''),
+            ('GET', '/questions?page=1000', b''),
+            ('GET', '/questions?after=5&limit=0', b''),
+            ('POST', '/questions/search', b'{"searchTerm": "title"}'),
+        ]
+        responses = call_asgi(app, [request + ('127.0.0.1',)
+                                    for request in requests])
+
+        for (method, path, body), (status, headers, content, _) in zip(
+                requests, responses):
+            res = self.client().open(path, method=method, data=body,
+                                     content_type='application/json')
+            self.assertEqual(status, res.status_code, path)
+            self.assertEqual(content, res.data, path)
+            self.assertEqual(headers.get('etag'), res.headers.get('ETag'))
+
+    @unittest.skipUnless(aiosqlite, 'aiosqlite is not installed')
+    def test_asgi_passes_other_routes_to_flask(self):
+        app = create_asgi_app({
+            'SQLALCHEMY_DATABASE_URI': self.sample_database(),
+            'TESTING': True, 'RATE_LIMIT_PER_MINUTE': 60,
+            'RATE_LIMIT_BURST': 2})
+        body = json.dumps(self.quiz).encode()
+        # Each client has a bucket of its own
+        requests = [('POST', '/quizzes/round', body, '10.0.0.{}'.format(i))
+                    for i in range(4)]
+        requests += [('POST', '/quizzes/round', body, '10.0.0.1')] * 2
+        requests += [('GET', '/questions/export', b'', '10.0.0.9')]
+        responses = call_asgi(app, requests)
+        export = self.client().get('/questions/export')
+
+        self.assertEqual([response[0] for response in responses[:6]],
+                         [200, 200, 200, 200, 200, 429])
+        self.assertEqual(responses[6][0], 200)
+        self.assertEqual(responses[6][2], export.data)
+        # Streamed a line at a time, not buffered
+        self.assertGreater(responses[6][3], 2)
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -10,12 +10,15 @@ class QuizView extends Component {
     this.state = {
       quizCategory: null,
       previousQuestions: [],
+      roundQuestions: [],
       showAnswer: false,
       categories: {},
       numCorrect: 0,
       currentQuestion: {},
       guess: '',
       forceEnd: false,
+      player: '',
+      rank: null,
     };
   }
 
@@ -35,39 +38,36 @@ class QuizView extends Component {
   }
 
   selectCategory = ({ type, id = 0 }) => {
-    this.setState({ quizCategory: { type, id } }, this.getNextQuestion);
+    this.setState({ quizCategory: { type, id } }, this.getRound);
   };
 
   handleChange = (event) => {
     this.setState({ [event.target.name]: event.target.value });
   };
 
-  getNextQuestion = () => {
-    const previousQuestions = [...this.state.previousQuestions];
-    if (this.state.currentQuestion.id) {
-      previousQuestions.push(this.state.currentQuestion.id);
-    }
-
+  getRound = () => {
     $.ajax({
-      url: '/quizzes', //TODO: update request URL
+      url: '/quizzes/round',
       type: 'POST',
       dataType: 'json',
       contentType: 'application/json',
       data: JSON.stringify({
-        previous_questions: previousQuestions,
+        previous_questions: this.state.previousQuestions,
         quiz_category: this.state.quizCategory,
+        count: questionsPerPlay,
       }),
       xhrFields: {
         withCredentials: true,
       },
       crossDomain: true,
       success: (result) => {
+        const [currentQuestion, ...roundQuestions] = result.questions;
         this.setState({
           showAnswer: false,
-          previousQuestions: previousQuestions,
-          currentQuestion: result.question,
+          roundQuestions: roundQuestions,
+          currentQuestion: currentQuestion,
           guess: '',
-          forceEnd: result.question ? false : true,
+          forceEnd: false,
         });
         return;
       },
@@ -78,6 +78,24 @@ class QuizView extends Component {
     });
   };
 
+  getNextQuestion = () => {
+    const previousQuestions = [...this.state.previousQuestions];
+    if (this.state.currentQuestion.id) {
+      previousQuestions.push(this.state.currentQuestion.id);
+    }
+
+    // The questions of the round were loaded when it started
+    const [currentQuestion, ...roundQuestions] = this.state.roundQuestions;
+    this.setState({
+      showAnswer: false,
+      previousQuestions: previousQuestions,
+      roundQuestions: roundQuestions,
+      currentQuestion: currentQuestion || {},
+      guess: '',
+      forceEnd: currentQuestion ? false : true,
+    });
+  };
+
   submitGuess = (event) => {
     event.preventDefault();
     let evaluate = this.evaluateAnswer();
@@ -87,15 +105,44 @@ class QuizView extends Component {
     });
   };
 
+  submitScore = (event) => {
+    event.preventDefault();
+    $.ajax({
+      url: '/scores',
+      type: 'POST',
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        player: this.state.player,
+        quiz_category: this.state.quizCategory,
+        correct: this.state.numCorrect,
+      }),
+      xhrFields: {
+        withCredentials: true,
+      },
+      crossDomain: true,
+      success: (result) => {
+        this.setState({ rank: result.rank });
+        return;
+      },
+      error: (error) => {
+        alert('Unable to save score. Please try your request again');
+        return;
+      },
+    });
+  };
+
   restartGame = () => {
     this.setState({
       quizCategory: null,
       previousQuestions: [],
+      roundQuestions: [],
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
       guess: '',
       forceEnd: false,
+      rank: null,
     });
   };
 
@@ -132,6 +179,24 @@ class QuizView extends Component {
         <div className='final-header'>
           Your Final Score is {this.state.numCorrect}
         </div>
+        {this.state.rank ? (
+          <div className='final-rank'>You are ranked #{this.state.rank}</div>
+        ) : (
+          <form onSubmit={this.submitScore}>
+            <input
+              type='text'
+              name='player'
+              placeholder='Your name'
+              value={this.state.player}
+              onChange={this.handleChange}
+            />
+            <input
+              className='submit-score button'
+              type='submit'
+              value='Save Score'
+            />
+          </form>
+        )}
         <div className='play-again button' onClick={this.restartGame}>
           Play Again?
         </div>